@@ -1,8 +1,22 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import os
-from collections import Counter
+import queue
+from collections import Counter, OrderedDict, deque
 import json
+import hashlib
+import logging
+import re
+import sys
+import threading
+import time
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+# 공유 데이터셋을 필터링할 때 방어적 복사 대신 지연 복사(Copy-on-Write)를 사용 (pandas 3부터는 기본값)
+if int(pd.__version__.split('.')[0]) < 3: pd.set_option('mode.copy_on_write', True)
+
+logger = logging.getLogger(__name__)
 
 # ---------------------------------------------------------
 # [설정] 페이지 설정 (가장 먼저 실행되어야 함)
@@ -26,14 +40,14 @@ except ImportError:
 # [데이터 로드] 외부 데이터 파일 불러오기
 # ---------------------------------------------------------
 try:
-    from matchup_data import MATCHUP_DB
+    from notice_data import NOTICE_DB
 except ImportError:
-    MATCHUP_DB = {}
+    NOTICE_DB = []
 
 try:
-    from notice_data import NOTICE_DB
+    from hero_alias_data import HERO_ALIAS_DB
 except ImportError:
-    NOTICE_DB = []
+    HERO_ALIAS_DB = {}
 
 # ---------------------------------------------------------
 # CSS 스타일
@@ -191,50 +205,133 @@ st.markdown("""
 # ---------------------------------------------------------
 # [데이터 전처리] 영웅 이름 정렬 함수 (전역 사용)
 # ---------------------------------------------------------
+# 별칭 -> 대표 이름 (예: '쁘' -> '브브'). 데이터와 공략 파일의 방덱/공덱 이름은 적재 시점에 대표 이름으로 통일됨
+HERO_ALIASES = {alias: canonical for canonical, aliases in HERO_ALIAS_DB.items() for alias in aliases}
+# 별칭 테이블이 바뀌면 정규화된 캐시도 다시 만들어야 하므로 캐시 키에 포함
+ALIAS_SIGNATURE = hashlib.sha1(json.dumps(sorted(HERO_ALIASES.items()), ensure_ascii=False).encode('utf-8')).hexdigest()[:12]
+
+def canonicalize_hero(name):
+    return HERO_ALIASES.get(name, name)
+
 def normalize_team_str(team_str):
     if not isinstance(team_str, str): return str(team_str)
     parts = team_str.replace(',', ' ').split()
-    parts = [p.strip() for p in parts if p.strip()]
+    parts = [canonicalize_hero(p.strip()) for p in parts if p.strip()]
     parts.sort()
     return ", ".join(parts)
 
-# [데이터 전처리] MATCHUP_DB 키 정규화
-if MATCHUP_DB:
-    NORMALIZED_DB = {}
-    for enemy, my_decks in MATCHUP_DB.items():
-        norm_enemy = normalize_team_str(enemy)
-        NORMALIZED_DB[norm_enemy] = {}
-        for my_deck, guide in my_decks.items():
-            norm_my_deck = normalize_team_str(my_deck)
-            NORMALIZED_DB[norm_enemy][norm_my_deck] = guide
-    MATCHUP_DB = NORMALIZED_DB
+# ---------------------------------------------------------
+# [데이터 전처리] 영웅 ID 및 팀 비트마스크 인코딩
+# 각 영웅에 정수 ID를 부여하고, 팀을 uint64 비트마스크(64명 단위 워드)로 저장하여
+# 포함/제외/부분집합 검색을 NumPy 비트 연산으로 처리합니다.
+# ---------------------------------------------------------
+MASK_SUFFIX = "_마스크"
+
+def build_hero_ids(team_series_list, base_ids=None):
+    # base_ids가 주어지면 기존 ID는 유지하고 새 영웅만 뒤에 추가 (증분 적재용)
+    heroes = set()
+    for series in team_series_list:
+        for team in series.dropna().unique():
+            heroes.update(h.strip() for h in str(team).split(',') if h.strip())
+    hero_ids = dict(base_ids or {})
+    for h in sorted(heroes - hero_ids.keys()): hero_ids[h] = len(hero_ids)
+    return hero_ids
+
+def get_mask_words(hero_ids):
+    return max(1, (len(hero_ids) + 63) // 64)
+
+def heroes_to_mask(heroes, hero_ids):
+    mask = np.zeros(get_mask_words(hero_ids), dtype=np.uint64)
+    for h in heroes:
+        hero_id = hero_ids.get(h.strip())
+        if hero_id is not None:
+            mask[hero_id // 64] |= np.uint64(1 << (hero_id % 64))
+    return mask
+
+def mask_to_heroes(mask, hero_ids):
+    return [h for h, i in hero_ids.items() if int(mask[i // 64]) >> (i % 64) & 1]
+
+def encode_team_masks(team_series, hero_ids):
+    # 고유 팀 문자열 단위로 한 번만 인코딩한 뒤 행에 펼침 (범주형이면 기존 코드를 그대로 사용)
+    words = get_mask_words(hero_ids)
+    if isinstance(team_series.dtype, pd.CategoricalDtype):
+        codes, uniques = team_series.cat.codes.to_numpy(), team_series.cat.categories
+    else:
+        codes, uniques = pd.factorize(team_series)
+    if len(uniques) == 0: return np.zeros((len(team_series), words), dtype=np.uint64)
+    unique_masks = np.stack([heroes_to_mask(str(t).split(','), hero_ids) for t in uniques])
+    return unique_masks[codes]
+
+def add_team_mask_columns(df, team_col, hero_ids):
+    masks = encode_team_masks(df[team_col], hero_ids)
+    for w in range(masks.shape[1]):
+        df[f"{team_col}{MASK_SUFFIX}{w}"] = masks[:, w]
+
+# ---------------------------------------------------------
+# [데이터 전처리] 반복 값이 많은 문자열 컬럼을 범주형(Categorical)으로 저장
+# 펫/스순/속공/길드/기준/날짜/정렬된 팀 문자열은 종류가 적고 행마다 반복되므로
+# 사전(categories) + 정수 코드로 저장하여 메모리를 줄이고 groupby/value_counts를 코드 단위로 처리합니다.
+# ---------------------------------------------------------
+CATEGORICAL_COLS = ['방어팀 펫', '공격팀 펫', '방어팀 스순', '공격팀 스순', '속공', '상대 길드', '기준', '날짜', '방어팀_정렬', '공격팀_정렬']
+
+def encode_categorical_columns(df):
+    for col in CATEGORICAL_COLS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(str).astype('category')
+    return df
+
+def get_value_counts(series):
+    # 범주형 value_counts는 등장하지 않은 범주도 0건으로 포함하므로 제외
+    counts = series.value_counts()
+    return counts[counts > 0]
+
+def attach_hero_masks(df, base_ids=None):
+    hero_ids = build_hero_ids([df['방어팀_정렬'], df['공격팀_정렬']], base_ids)
+    add_team_mask_columns(df, '방어팀_정렬', hero_ids)
+    add_team_mask_columns(df, '공격팀_정렬', hero_ids)
+    df.attrs['hero_ids'] = hero_ids
+    return df
+
+def get_team_masks(df, team_col):
+    words = get_mask_words(df.attrs.get('hero_ids', {}))
+    return np.column_stack([df[f"{team_col}{MASK_SUFFIX}{w}"].to_numpy(dtype=np.uint64) for w in range(words)])
+
+def exclude_heroes_mask(row_masks, heroes, hero_ids):
+    return ~(row_masks & heroes_to_mask(heroes, hero_ids)).any(axis=1)
 
 # ---------------------------------------------------------
 # 1. 데이터 로드 및 전처리
 # ---------------------------------------------------------
-@st.cache_data
-def load_data():
-    possible_filenames = [
-        '길드전 답지.xlsx - Sheet1.csv', 
-        '길드전_답지.xlsx - Sheet1.csv',
-        '길드전 답지.xlsx', 
-        '길드전_답지.xlsx'
-    ]
-    input_file = None
-    for fname in possible_filenames:
-        if os.path.exists(fname):
-            input_file = fname
-            break
-    
-    if input_file is None: return None
+DATA_FILENAMES = [
+    '길드전 답지.xlsx - Sheet1.csv', 
+    '길드전_답지.xlsx - Sheet1.csv',
+    '길드전 답지.xlsx', 
+    '길드전_답지.xlsx'
+]
+DATA_DIR = "war_data"  # 전투별 파일(xlsx/csv)을 모아두는 폴더 (있으면 단일 파일보다 우선)
+GUIDE_FILE = "matchup_guides.jsonl"  # 매치업 상세 공략 (한 줄에 공략 하나)
+WAR_FILE_EXTS = ('.xlsx', '.csv')
+CACHE_DIR = ".data_cache"
+STORE_DIR = os.path.join(CACHE_DIR, "war_store")
+CACHE_FORMAT = 2  # 캐시에 저장하는 데이터프레임 구조가 바뀌면 올려서 기존 캐시를 무효화
+
+def find_data_file():
+    for fname in DATA_FILENAMES:
+        if os.path.exists(fname): return fname
+    return None
 
+def read_source_file(input_file):
     try:
-        if input_file.endswith('.xlsx'): df = pd.read_excel(input_file)
-        else:
-            try: df = pd.read_csv(input_file, encoding='cp949')
-            except: df = pd.read_csv(input_file, encoding='utf-8')
+        if input_file.endswith('.xlsx'): return pd.read_excel(input_file)
+        try: return pd.read_csv(input_file, encoding='cp949')
+        except: return pd.read_csv(input_file, encoding='utf-8')
     except: return None
 
+def infer_date_from_filename(path):
+    match = re.search(r'(\d{6})', os.path.basename(path))
+    return match.group(1) if match else 'Unknown'
+
+def normalize_records(df, default_date='Unknown'):
     df['방어팀_정렬'] = df['방어팀'].apply(normalize_team_str)
     df['공격팀_정렬'] = df['공격팀'].apply(normalize_team_str)
     
@@ -247,13 +344,299 @@ def load_data():
     if '날짜' in df.columns:
         df['날짜'] = df['날짜'].fillna('').astype(str).str.strip()
         df['날짜'] = df['날짜'].apply(lambda x: x.replace('.0', '') if x.endswith('.0') else x)
-    else: df['날짜'] = 'Unknown'
+    else: df['날짜'] = default_date
         
     df = df[df['방어팀_정렬'] != ""]
-    df = df[df['공격팀_정렬'] != ""]
+    df = df[df['공격팀_정렬'] != ""].copy()
+    return df
+
+# ---------------------------------------------------------
+# [캐시] 정규화된 데이터프레임을 Parquet으로 디스크에 저장
+# 원본 파일 경로 + 수정시각(mtime) + 내용 해시(sha256)가 같으면 엑셀 파싱 없이 바로 로드하고,
+# 하나라도 달라지면 자동으로 다시 만듭니다.
+# ---------------------------------------------------------
+try:
+    import pyarrow  # noqa: F401 (to_parquet / read_parquet 엔진)
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+def get_file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''): h.update(chunk)
+    return h.hexdigest()
+
+def get_cache_paths(source_path):
+    key = hashlib.sha1(os.path.abspath(source_path).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, f"{key}.parquet"), os.path.join(CACHE_DIR, f"{key}.json")
+
+def get_file_signature(path):
+    stat = os.stat(path)
+    return {'mtime': stat.st_mtime, 'size': stat.st_size}
+
+def is_source_unchanged(meta, path):
+    # mtime/크기가 같으면 통과, 다르면 해시로 재확인 (복사/재업로드로 mtime만 바뀐 경우)
+    # 반환값: (변경 없음 여부, 메타 갱신 필요 여부)
+    sig = get_file_signature(path)
+    if meta.get('mtime') == sig['mtime'] and meta.get('size') == sig['size']: return True, False
+    if meta.get('sha256') != get_file_hash(path): return False, False
+    meta.update(sig)
+    return True, True
+
+def write_json_atomic(path, data):
+    with open(path + '.tmp', 'w', encoding='utf-8') as f: json.dump(data, f, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+
+def write_parquet_atomic(path, df):
+    df.to_parquet(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+
+def read_cached_records(source_path):
+    if not HAS_PYARROW: return None
+    data_path, meta_path = get_cache_paths(source_path)
+    if not (os.path.exists(data_path) and os.path.exists(meta_path)): return None
+    try:
+        with open(meta_path, encoding='utf-8') as f: meta = json.load(f)
+        if meta.get('source') != os.path.abspath(source_path) or meta.get('format') != CACHE_FORMAT: return None
+        if meta.get('aliases') != ALIAS_SIGNATURE: return None
+        unchanged, meta_dirty = is_source_unchanged(meta, source_path)
+        if not unchanged: return None
+        if meta_dirty: write_json_atomic(meta_path, meta)
+        df = pd.read_parquet(data_path)
+        df.attrs['hero_ids'] = {h: i for i, h in enumerate(meta['heroes'])}
+        return df
+    except Exception:
+        return None
+
+def write_cached_records(source_path, df):
+    if not HAS_PYARROW: return
+    data_path, meta_path = get_cache_paths(source_path)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        heroes = sorted(df.attrs['hero_ids'], key=df.attrs['hero_ids'].get)
+        meta = {'source': os.path.abspath(source_path), 'format': CACHE_FORMAT, 'aliases': ALIAS_SIGNATURE, **get_file_signature(source_path),
+                'sha256': get_file_hash(source_path), 'heroes': heroes}
+        # 임시 파일에 쓴 뒤 교체하여, 쓰는 도중 다른 프로세스가 깨진 캐시를 읽지 않도록 함
+        write_parquet_atomic(data_path, df)
+        write_json_atomic(meta_path, meta)
+    except Exception:
+        pass
+
+# ---------------------------------------------------------
+# [증분 적재] 전투별 파일 폴더(DATA_DIR)를 파일 단위로 적재
+# 새로 추가되었거나 바뀐 파일만 파싱/정규화해서 파일별 Parquet 조각으로 저장하고,
+# 나머지 파일은 이미 정규화된 조각을 그대로 읽습니다. 영웅 ID는 기존 순서를 유지하며 새 영웅만 추가됩니다.
+# ---------------------------------------------------------
+def list_war_files(data_dir):
+    if not os.path.isdir(data_dir): return []
+    return sorted(f for f in os.listdir(data_dir) if f.lower().endswith(WAR_FILE_EXTS) and not f.startswith('~$'))
+
+def load_store_manifest():
+    try:
+        with open(os.path.join(STORE_DIR, 'manifest.json'), encoding='utf-8') as f: manifest = json.load(f)
+    except Exception:
+        manifest = None
+    # 별칭 테이블이 바뀌었으면 저장된 조각은 예전 이름으로 정규화된 것이므로 전부 다시 적재
+    if not manifest or manifest.get('aliases') != ALIAS_SIGNATURE:
+        manifest = {'files': {}, 'heroes': [], 'aliases': ALIAS_SIGNATURE}
+    return manifest
+
+def ingest_war_directory(data_dir):
+    manifest = load_store_manifest()
+    entries = manifest['files']
+    war_files = list_war_files(data_dir)
+    if HAS_PYARROW: os.makedirs(STORE_DIR, exist_ok=True)
+
+    parts = []
+    dirty = False
+    for fname in war_files:
+        path = os.path.join(data_dir, fname)
+        entry = entries.get(fname)
+        part_path = os.path.join(STORE_DIR, entry['part']) if entry else None
+        if HAS_PYARROW and entry and os.path.exists(part_path):
+            unchanged, meta_dirty = is_source_unchanged(entry, path)
+            if unchanged:
+                dirty |= meta_dirty
+                parts.append(pd.read_parquet(part_path))
+                continue
+
+        raw = read_source_file(path)
+        try:
+            part = normalize_records(raw, default_date=infer_date_from_filename(fname)) if raw is not None else None
+        except Exception:
+            logger.exception("전투 파일 형식이 올바르지 않습니다 (필수 컬럼 누락 등): %s", path)
+            part = None
+        if part is None:
+            # 저장 도중이거나 깨진/형식이 다른 파일이면 마지막으로 정상 적재한 조각을 유지 (매니페스트는 그대로 두어 다음 적재 때 다시 시도)
+            if HAS_PYARROW and entry and os.path.exists(part_path):
+                logger.warning("전투 파일을 적재하지 못해 이전 조각을 사용합니다: %s", path)
+                parts.append(pd.read_parquet(part_path))
+            else:
+                logger.warning("전투 파일을 적재하지 못해 건너뜁니다: %s", path)
+            continue
+        parts.append(part)
+        if HAS_PYARROW:
+            part_name = hashlib.sha1(fname.encode('utf-8')).hexdigest()[:16] + '.parquet'
+            write_parquet_atomic(os.path.join(STORE_DIR, part_name), part)
+            entries[fname] = {'part': part_name, 'rows': len(part), **get_file_signature(path), 'sha256': get_file_hash(path)}
+            dirty = True
+
+    # 폴더에서 사라진 파일의 조각 정리
+    for fname in [f for f in entries if f not in war_files]:
+        stale = os.path.join(STORE_DIR, entries.pop(fname)['part'])
+        if os.path.exists(stale): os.remove(stale)
+        dirty = True
+
+    if not parts: return None
+    # 파일별 조각의 범주가 서로 다르므로 합친 뒤에 범주형으로 변환
+    df = encode_categorical_columns(pd.concat(parts, ignore_index=True))
+    df = attach_hero_masks(df, base_ids={h: i for i, h in enumerate(manifest['heroes'])})
+    if len(df.attrs['hero_ids']) != len(manifest['heroes']):
+        manifest['heroes'] = sorted(df.attrs['hero_ids'], key=df.attrs['hero_ids'].get)
+        dirty = True
+    if HAS_PYARROW and dirty: write_json_atomic(os.path.join(STORE_DIR, 'manifest.json'), manifest)
     return df
 
-df = load_data()
+def load_data(data_dir=DATA_DIR):
+    if list_war_files(data_dir): return ingest_war_directory(data_dir)
+
+    input_file = find_data_file()
+    if input_file is None: return None
+
+    cached = read_cached_records(input_file)
+    if cached is not None: return cached
+
+    df = read_source_file(input_file)
+    if df is None: return None
+    try:
+        df = normalize_records(df)
+    except Exception:
+        logger.exception("데이터 파일 형식이 올바르지 않습니다 (필수 컬럼 누락 등): %s", input_file)
+        return None
+    df = attach_hero_masks(encode_categorical_columns(df))
+    write_cached_records(input_file, df)
+    return df
+
+# ---------------------------------------------------------
+# [핫 리로드] 데이터 파일 감시 및 스냅샷 원자적 교체
+# 백그라운드 스레드가 원본 파일의 mtime/크기를 주기적으로 확인하고, 바뀌면 새 데이터셋을 만든 뒤
+# 스냅샷 참조를 한 번에 교체합니다. 실행 중인 rerun은 시작할 때 잡은 이전 스냅샷을 그대로 쓰고,
+# 파싱이 끝날 때까지 어떤 요청도 기다리지 않습니다.
+# ---------------------------------------------------------
+RELOAD_INTERVAL_SEC = 5
+
+def get_source_signature(data_dir=DATA_DIR):
+    war_files = list_war_files(data_dir)
+    if war_files:
+        return tuple((f, *get_file_signature(os.path.join(data_dir, f)).values()) for f in war_files)
+    input_file = find_data_file()
+    if input_file is None: return None
+    return ((input_file, *get_file_signature(input_file).values()),)
+
+class DatasetSnapshot:
+    def __init__(self, df, version, signature):
+        self.df = df
+        self.version = version
+        self.signature = signature
+        # 프로세스 재시작 후에도 같은 원본/별칭이면 같은 값 (디스크에 저장되는 캐시의 키로 사용)
+        self.content_id = hashlib.sha1(repr((signature, ALIAS_SIGNATURE)).encode('utf-8')).hexdigest()[:12]
+        self.loaded_at = time.time()
+
+class DatasetStore:
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self._reload_lock = threading.Lock()
+        signature = get_source_signature(data_dir)
+        self.snapshot = DatasetSnapshot(load_data(data_dir), 1, signature)
+        threading.Thread(target=self._watch, name="dataset-watcher", daemon=True).start()
+
+    def _watch(self):
+        while True:
+            time.sleep(RELOAD_INTERVAL_SEC)
+            try: self.reload_if_changed()
+            except Exception: pass
+
+    def reload_if_changed(self):
+        if not self._reload_lock.acquire(blocking=False): return False
+        try:
+            signature = get_source_signature(self.data_dir)
+            if signature is None or signature == self.snapshot.signature: return False
+            new_df = load_data(self.data_dir)
+            # 업로드 도중이라 파싱에 실패하면 기존 스냅샷을 유지하고 다음 주기에 다시 시도
+            if new_df is None: return False
+            self.snapshot = DatasetSnapshot(new_df, self.snapshot.version + 1, signature)
+            return True
+        finally:
+            self._reload_lock.release()
+
+@st.cache_resource
+def get_dataset_store(data_dir=DATA_DIR):
+    return DatasetStore(data_dir)
+
+# ---------------------------------------------------------
+# [메모리] 공유 데이터셋과 세션별 오버헤드 집계
+# 데이터셋/큐브/인덱스는 프로세스에 한 벌만 두고 모든 세션이 읽기 전용으로 공유합니다.
+# 세션마다 추가로 쓰는 메모리(session_state)만 따로 추정해 접속자 수에 따른 증가분을 보여줍니다.
+# 크기는 이 파일에 정의된 객체(인덱스, 캐시, 대화 등)의 속성까지 따라가며 추정하고,
+# AI 검색 인덱스처럼 첫 질문 때 만들어지는 객체는 집계를 위해 미리 만들지 않으므로 공유 메모리에서 빠집니다.
+# ---------------------------------------------------------
+SESSION_STALE_SEC = 1800  # 이 시간 동안 실행이 없던 세션은 집계에서 제외
+
+def estimate_size(obj, _seen=None):
+    _seen = _seen if _seen is not None else set()
+    if id(obj) in _seen: return 0
+    _seen.add(id(obj))
+    if isinstance(obj, (pd.DataFrame, pd.Series)): return int(obj.memory_usage(deep=True).sum()) if isinstance(obj, pd.DataFrame) else int(obj.memory_usage(deep=True))
+    if isinstance(obj, np.ndarray): return obj.nbytes
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict): size += sum(estimate_size(k, _seen) + estimate_size(v, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)): size += sum(estimate_size(v, _seen) for v in obj)
+    elif type(obj).__module__ == __name__ and hasattr(obj, '__dict__'): size += estimate_size(vars(obj), _seen)
+    return size
+
+class SessionRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}  # session_id -> (추정 바이트, 마지막 실행 시각)
+
+    def record(self, session_id, size):
+        now = time.time()
+        with self._lock:
+            self._sessions[session_id] = (size, now)
+            for sid in [sid for sid, (_, ts) in self._sessions.items() if now - ts > SESSION_STALE_SEC]:
+                del self._sessions[sid]
+
+    def summary(self):
+        with self._lock: sizes = [size for size, _ in self._sessions.values()]
+        return len(sizes), sum(sizes)
+
+@st.cache_resource
+def get_session_registry():
+    return SessionRegistry()
+
+def record_session_usage():
+    ctx = get_script_run_ctx()
+    if ctx is None: return
+    state = {k: v for k, v in st.session_state.items()}
+    get_session_registry().record(ctx.session_id, estimate_size(state))
+
+def get_shared_memory_usage(snapshot, guide_store):
+    # [(항목, 바이트)] 같은 객체를 여러 캐시가 참조해도 한 번만 셈
+    seen = set()
+    usage = [('데이터셋', estimate_size(snapshot.df, seen) if snapshot.df is not None else 0)]
+    if snapshot.df is not None:
+        usage.append(('집계 큐브', estimate_size(get_war_cube(snapshot.version, snapshot.df), seen)))
+        usage.append(('매치업 인덱스', estimate_size(get_full_matchup_index(snapshot.version, snapshot.df), seen)))
+    usage.append(('필터 캐시', estimate_size(get_filter_cache(), seen)))
+    usage.append(('HTML 캐시', estimate_size(get_html_cache(), seen)))
+    usage.append(('AI 응답 캐시', estimate_size(get_response_cache(), seen)))
+    usage.append(('공략 인덱스', estimate_size(guide_store, seen)))
+    return usage
+
+# 이번 rerun 동안 사용할 스냅샷 (중간에 교체되어도 이 참조는 바뀌지 않음)
+data_snapshot = get_dataset_store().snapshot
+df = data_snapshot.df
 
 # ---------------------------------------------------------
 # 2. 헬퍼 함수
@@ -281,35 +664,229 @@ def get_mode(series):
     count = valid[valid == mode_val].shape[0]
     return mode_val, count
 
-def get_speed_distribution(series):
-    if series.empty: return "-"
-    valid = series[series != '']
-    if valid.empty: return "-"
-    counts = valid.value_counts()
+def format_speed_distribution(counts):
+    # counts: {'선공': n, '후공': m, ...} (빈 값 제외)
+    if not counts: return "-"
     sun = counts.get('선공', 0)
     hoo = counts.get('후공', 0)
     span_style = "color:#6b7280; font-size:0.8em; font-weight:400;"
     if sun == 0 and hoo == 0:
-        mode_val, count = get_mode(series)
-        return f"<b>{mode_val}</b> <span style='{span_style}'>({count}회)</span>"
+        mode_val = sorted(counts.items(), key=lambda x: (-x[1], x[0]))[0][0]
+        return f"<b>{mode_val}</b> <span style='{span_style}'>({counts[mode_val]}회)</span>"
     parts = []
     if sun > 0: parts.append(f"<b>선공</b> <span style='{span_style}'>({sun}회)</span>")
     if hoo > 0: parts.append(f"<b>후공</b> <span style='{span_style}'>({hoo}회)</span>")
     return "&nbsp; ".join(parts)
 
-def expand_synonyms(keywords):
-    expanded = set(keywords)
-    for k in keywords:
-        if '브브' in k: expanded.add(k.replace('브브', '쁘'))
-        if '쁘' in k: expanded.add(k.replace('쁘', '브브'))
-    return list(expanded)
+# ---------------------------------------------------------
+# [매치업 인덱스] 방어덱 x 공격덱 요약을 한 번에 집계
+# 카드마다 groupby/value_counts/get_mode를 반복하지 않고, 세부 조합별 건수를 한 번 집계한 뒤
+# (방어덱, 공격덱) 단위 요약(건수, 최빈 펫/스순, 속공 분포, 상세 표)을 만들어 두고 조회만 합니다.
+# ---------------------------------------------------------
+PAIR_COLS = ['방어팀_정렬', '공격팀_정렬']
+DETAIL_COLS = ['공격팀 펫', '공격팀 스순', '속공', '방어팀 펫', '방어팀 스순']
+DETAIL_LABELS = ['공격 펫', '공격 스순', '속공', '방어 펫', '방어 스순']
+
+class MatchupIndex:
+    def __init__(self, defenses, attacks, summaries, detail=None, detail_positions=None):
+        self.defenses = defenses    # [(방어덱, 건수)] 건수 내림차순
+        self.attacks = attacks      # {방어덱: [공격덱, ...]} 건수 내림차순
+        self.summaries = summaries  # {(방어덱, 공격덱): 요약 dict}
+        self._detail = detail
+        self._detail_positions = detail_positions or {}
+
+    def get_detail_table(self, defense, attack):
+        # 상세 표는 펼쳤을 때만 잘라서 만듦 (미리 모든 조합의 표를 만들지 않음)
+        positions = self._detail_positions.get((defense, attack))
+        if positions is None: return pd.DataFrame(columns=DETAIL_LABELS + ['빈도'])
+        table = self._detail.iloc[positions][DETAIL_COLS + ['빈도']].reset_index(drop=True)
+        table.columns = DETAIL_LABELS + ['빈도']
+        return table
+
+def get_pair_modes(detail, col):
+    # get_mode와 같은 규칙: 빈 값 제외, 동률이면 값 오름차순 첫 번째
+    valid = detail[detail[col] != '']
+    if valid.empty: return {}
+    counts = valid.groupby(PAIR_COLS + [col], observed=True)['빈도'].sum().reset_index()
+    counts = counts.sort_values(PAIR_COLS + ['빈도', col], ascending=[True, True, False, True])
+    counts = counts.drop_duplicates(PAIR_COLS)
+    return {(d, a): (v, int(c)) for d, a, v, c in counts[PAIR_COLS + [col, '빈도']].itertuples(index=False)}
+
+def build_matchup_index(frame):
+    if frame.empty: return MatchupIndex([], {}, {})
+    detail = frame.groupby(PAIR_COLS + DETAIL_COLS, observed=True).size().reset_index(name='빈도')
+    return build_matchup_index_from_detail(detail)
+
+def build_matchup_index_from_detail(detail):
+    detail = detail[detail['빈도'] > 0]
+    if detail.empty: return MatchupIndex([], {}, {})
+    pair_counts = detail.groupby(PAIR_COLS, observed=True)['빈도'].sum().reset_index()
+    pair_counts = pair_counts.sort_values(['빈도', '공격팀_정렬'], ascending=[False, True])
+    def_counts = pair_counts.groupby('방어팀_정렬', observed=True)['빈도'].sum().reset_index()
+    def_counts = def_counts.sort_values(['빈도', '방어팀_정렬'], ascending=[False, True])
+
+    pet_modes = get_pair_modes(detail, '공격팀 펫')
+    skill_modes = get_pair_modes(detail, '공격팀 스순')
+    speed_counts = {}
+    valid_speed = detail[detail['속공'] != '']
+    for d, a, v, c in valid_speed.groupby(PAIR_COLS + ['속공'], observed=True)['빈도'].sum().reset_index().itertuples(index=False):
+        if c > 0: speed_counts.setdefault((d, a), {})[v] = int(c)
+
+    attacks, summaries = {}, {}
+    for d, a, c in pair_counts.itertuples(index=False):
+        attacks.setdefault(d, []).append(a)
+        pet, pet_cnt = pet_modes.get((d, a), ("-", 0))
+        skill, skill_cnt = skill_modes.get((d, a), ("-", 0))
+        summaries[(d, a)] = {
+            'count': int(c), 'pet': pet, 'pet_count': pet_cnt, 'skill': skill, 'skill_count': skill_cnt,
+            'speed_html': format_speed_distribution(speed_counts.get((d, a), {})),
+        }
+
+    detail = detail.sort_values(PAIR_COLS + ['빈도'], ascending=[True, True, False], kind='stable').reset_index(drop=True)
+    detail_positions = detail.groupby(PAIR_COLS, observed=True, sort=False).indices
 
-def check_match(target_str, search_terms):
-    for term in search_terms:
-        synonyms = {term}
-        if term in ['브브', '쁘']: synonyms.update(['브브', '쁘'])
-        if not any(syn in target_str for syn in synonyms): return False 
-    return True
+    defenses = [(d, int(c)) for d, c in def_counts.itertuples(index=False)]
+    return MatchupIndex(defenses, attacks, summaries, detail, detail_positions)
+
+@st.cache_resource(max_entries=4)
+def get_full_matchup_index(data_version, _df):
+    # 필터가 없는 기본 화면용 인덱스는 데이터 버전마다 한 번만 생성
+    return build_matchup_index(_df)
+
+# ---------------------------------------------------------
+# [검색 인덱스] 영웅 이름(및 부분 이름) -> 팀 ID 역색인
+# 영웅 이름의 모든 부분 문자열(예: '카구', '구라')을 키로 팀 ID 목록(posting list)을 미리 만들어 두고,
+# 여러 영웅 검색은 posting list 교집합으로 처리합니다. 검색할 때 행을 훑지 않습니다.
+# ---------------------------------------------------------
+EMPTY_POSTING = np.array([], dtype=np.int64)
+
+def get_name_substrings(name):
+    return {name[i:j] for i in range(len(name)) for j in range(i + 1, len(name) + 1)}
+
+class HeroSearchIndex:
+    def __init__(self, teams):
+        # teams: 정규화된 팀 문자열 목록 (목록 위치가 팀 ID)
+        postings = {}
+        for team_id, team in enumerate(teams):
+            for hero in str(team).split(','):
+                for key in get_name_substrings(hero.strip()):
+                    postings.setdefault(key, set()).add(team_id)
+        self.postings = {key: np.array(sorted(ids), dtype=np.int64) for key, ids in postings.items()}
+
+    def lookup(self, search_terms):
+        result = None
+        for term in search_terms:
+            ids = self.postings.get(canonicalize_hero(term), EMPTY_POSTING)
+            result = ids if result is None else np.intersect1d(result, ids, assume_unique=True)
+            if not len(result): break
+        return EMPTY_POSTING if result is None else result
+
+# ---------------------------------------------------------
+# [집계 큐브] (날짜, 상대 길드, 기준) 파티션별 세부 조합 건수
+# 원본 행 대신 파티션 단위로 미리 집계해 두고, 사이드바 필터 조합은 해당 파티션 조각만 골라 합산합니다.
+# 기록이 쌓여도 필터 비용은 파티션 수와 조합 수에만 비례합니다.
+# ---------------------------------------------------------
+CUBE_PARTITION_COLS = ['날짜', '상대 길드', '기준']
+
+class WarCube:
+    def __init__(self, df):
+        cube = df.groupby(CUBE_PARTITION_COLS + PAIR_COLS + DETAIL_COLS, observed=True).size().reset_index(name='빈도')
+        cube.attrs['hero_ids'] = df.attrs.get('hero_ids', {})
+        self.cube = cube
+        self.hero_ids = cube.attrs['hero_ids']
+        self.total = int(cube['빈도'].sum())
+        self.atk_masks = encode_team_masks(cube['공격팀_정렬'], self.hero_ids)
+        if isinstance(cube['방어팀_정렬'].dtype, pd.CategoricalDtype):
+            self.def_codes, def_teams = cube['방어팀_정렬'].cat.codes.to_numpy(), cube['방어팀_정렬'].cat.categories
+        else:
+            self.def_codes, def_teams = pd.factorize(cube['방어팀_정렬'])
+        self.def_search = HeroSearchIndex(def_teams)
+        # groupby 결과가 파티션 키 순으로 정렬되어 있으므로 연속 구간(start, stop)으로 저장
+        self.partitions = {}
+        keys = list(cube[CUBE_PARTITION_COLS].itertuples(index=False, name=None))
+        for pos, key in enumerate(keys):
+            if key in self.partitions: self.partitions[key][1] = pos + 1
+            else: self.partitions[key] = [pos, pos + 1]
+
+    def select_rows(self, view=None, dates=None, guilds=None):
+        date_set = set(dates) if dates else None
+        guild_set = set(guilds) if guilds else None
+        ranges = [np.arange(start, stop) for (d, g, v), (start, stop) in self.partitions.items()
+                  if (view is None or v == view) and (date_set is None or d in date_set) and (guild_set is None or g in guild_set)]
+        return np.concatenate(ranges) if ranges else np.array([], dtype=np.int64)
+
+    def query(self, view=None, dates=None, guilds=None, search_terms=None, excluded_heroes=None):
+        rows = self.select_rows(view, dates, guilds)
+        if search_terms and len(rows): rows = rows[np.isin(self.def_codes[rows], self.def_search.lookup(search_terms))]
+        if excluded_heroes and len(rows): rows = rows[exclude_heroes_mask(self.atk_masks[rows], excluded_heroes, self.hero_ids)]
+        subset = self.cube.iloc[rows]
+        # 여러 파티션에 걸친 같은 조합은 합산하여 매치업 인덱스 입력(detail) 형태로 반환
+        return subset.groupby(PAIR_COLS + DETAIL_COLS, observed=True)['빈도'].sum().reset_index()
+
+@st.cache_resource(max_entries=4)
+def get_war_cube(data_version, _df):
+    return WarCube(_df)
+
+# ---------------------------------------------------------
+# [필터 캐시] 전체 세션이 공유하는 LRU
+# 키: (데이터 버전, 기준, 정규화된 검색어, 날짜, 길드, 제외 영웅) -> (필터 결과 건수, 매치업 인덱스)
+# 같은 시간대에 여러 길드원이 같은 상대 길드/방덱을 조회하므로, 한 번 계산한 결과를 그대로 재사용합니다.
+# ---------------------------------------------------------
+FILTER_CACHE_SIZE = 256
+
+class LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize: self._data.popitem(last=False)
+
+    def get_or_create(self, key, factory):
+        value = self.get(key)
+        if value is None:
+            # 계산은 잠금 밖에서 수행 (동시에 같은 키가 계산되어도 결과는 동일)
+            value = factory()
+            self.put(key, value)
+        return value
+
+    def __len__(self):
+        return len(self._data)
+
+@st.cache_resource
+def get_filter_cache():
+    return LRUCache(FILTER_CACHE_SIZE)
+
+def make_filter_key(data_version, view_filter, search_terms, dates, guilds, excluded_heroes):
+    # 검색어는 별칭을 대표 이름으로 바꿔서 ('쁘'와 '브브'는 같은 결과이므로 같은 키)
+    return (data_version, view_filter, tuple(sorted({canonicalize_hero(t) for t in search_terms or []})), tuple(sorted(set(dates or []))),
+            tuple(sorted(set(guilds or []))), tuple(sorted(set(excluded_heroes or []))))
+
+def get_filtered_matchup_index(snapshot, view_filter, search_terms, dates, guilds, excluded_heroes):
+    def compute():
+        war_cube = get_war_cube(snapshot.version, snapshot.df)
+        detail = war_cube.query(view_filter, dates, guilds, search_terms, excluded_heroes)
+        count = int(detail['빈도'].sum())
+        # 필터로 걸러진 행이 없으면 데이터 버전별로 미리 만든 인덱스를 그대로 사용
+        if count == war_cube.total: return count, get_full_matchup_index(snapshot.version, snapshot.df)
+        return count, build_matchup_index_from_detail(detail)
+    key = make_filter_key(snapshot.version, view_filter, search_terms, dates, guilds, excluded_heroes)
+    return get_filter_cache().get_or_create(key, compute)
 
 def get_star_rating(score):
     if not isinstance(score, int): return ""
@@ -343,151 +920,1045 @@ def generate_guide_html(enemy_name, my_deck_name, guide):
     </div>
     """
 
+def build_card_html(defense_team, match_count, best_atk_team, best):
+    pick_rate = (best['count'] / match_count) * 100
+    best_pet, best_pet_count = best['pet'], best['pet_count']
+    best_skill, best_skill_count = best['skill'], best['skill_count']
+    speed_dist = best['speed_html']
+    def_tags = format_hero_tags(defense_team)
+    atk_tags = format_hero_tags(best_atk_team)
+    badge_style, badge_text = get_badge_style(match_count, pick_rate)
+    bar_color = badge_style.split(":")[1].replace(";", "").strip()
+    
+    raw_html = f"""
+        <div class="custom-card">
+            <div class="card-header">
+                <div style="flex: 1;"><span class="def-label">VS</span>{def_tags}</div>
+                <div class="badge" style="{badge_style}">{badge_text} ({match_count}건)</div>
+            </div>
+            <div class="info-row">
+                <div style="display:flex; justify-content:space-between; align-items:flex-end; margin-bottom:5px;">
+                    <div class="label">⚔️ 추천 공격팀</div>
+                    <div class="pick-rate-text">{pick_rate:.1f}% 픽률</div>
+                </div>
+                <div class="value">{atk_tags}</div>
+                <div class="progress-container"><div class="progress-bg"><div class="progress-fill" style="width: {pick_rate}%; background-color: {bar_color};"></div></div></div>
+            </div>
+            <div class="grid-2">
+                <div><div class="label">🐶 펫 <span style='font-weight:400; font-size:0.75em'>({best_pet_count}회)</span></div><div class="value">{best_pet}</div></div>
+                <div><div class="label">🏃 속공</div><div class="value" style="font-size:0.95rem;">{speed_dist}</div></div>
+            </div>
+            <div class="info-row" style="margin-top: 15px;">
+                <div class="label">⚡ 추천 스순 <span style='font-weight:400; font-size:0.8em'>({best_skill_count}회)</span></div>
+                <div class="skill-box">{best_skill}</div>
+            </div>
+        </div>
+    """
+    return clean_html(raw_html)
+
+def build_setting_html(summary):
+    sub_pet, sub_pet_cnt = summary['pet'], summary['pet_count']
+    sub_skill, sub_skill_cnt = summary['skill'], summary['skill_count']
+    sub_speed_dist = summary['speed_html']
+    return f"""
+        <div style="background-color: #f9fafb; padding: 12px; border-radius: 8px; margin-bottom: 12px; border: 1px solid #e5e7eb;">
+            <div style="font-size: 0.85rem; font-weight: 600; color: #4b5563; margin-bottom: 8px;">💡 이 조합의 추천 세팅</div>
+            <div style="display: flex; flex-wrap: wrap; gap: 15px; font-size: 0.9rem;">
+                <div>🐶 <b>{sub_pet}</b> <span style="color:#6b7280; font-size:0.8em">({sub_pet_cnt}회)</span></div>
+                <div>🏃 {sub_speed_dist}</div>
+                <div>⚡ <b>{sub_skill}</b> <span style="color:#6b7280; font-size:0.8em">({sub_skill_cnt}회)</span></div>
+            </div>
+        </div>
+    """
+
+# ---------------------------------------------------------
+# [공략 저장소] 매치업 공략 파일(GUIDE_FILE)을 인덱스로 찾고, 본문은 펼칠 때만 읽음
+# 파일 형식: 한 줄에 공략 하나 (JSON)
+#   {"enemy": 상대 방덱, "deck": 내 공덱, "summary": 핵심 요약, "difficulty": 세팅 난이도(1~5),
+#    "formation": 진형(HTML), "my_setting": [{"name", "desc"}, ...] 또는 문자열, "enemy_info": 상대 특이사항, "operate_tips": 운영법}
+# 처음 한 번 (정규화된 방덱 -> 공덱 -> 파일 내 위치/길이, 요약) 인덱스를 만들어 .data_cache에 저장하고,
+# 이후 실행에서는 인덱스만 읽습니다. 파일이 바뀌면(mtime/크기, 해시) 또는 별칭 테이블이 바뀌면 다시 만듭니다.
+# ---------------------------------------------------------
+GUIDE_INDEX_FORMAT = 1  # 인덱스 구조가 바뀌면 올려서 기존 인덱스를 무효화
+
+def get_guide_index_path(source_path):
+    key = hashlib.sha1(os.path.abspath(source_path).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, f"guides_{key}.json")
+
+def build_guide_index(source_path):
+    # 줄 단위로 읽으며 바이트 위치를 기록 (같은 방덱/공덱이 다시 나오면 뒤의 공략이 우선)
+    guides, skipped = {}, []
+    offset = 0
+    with open(source_path, 'rb') as f:
+        for line_no, line in enumerate(f, start=1):
+            if line.strip():
+                try:
+                    info = json.loads(line)
+                except ValueError:
+                    info = None
+                if isinstance(info, dict) and info.get('enemy') and info.get('deck'):
+                    enemy, deck = normalize_team_str(info['enemy']), normalize_team_str(info['deck'])
+                    guides.setdefault(enemy, {})[deck] = [offset, len(line), info.get('summary', '')]
+                else:
+                    skipped.append(line_no)
+            offset += len(line)
+    return guides, skipped
+
+def load_guide_index(source_path):
+    index_path = get_guide_index_path(source_path)
+    try:
+        with open(index_path, encoding='utf-8') as f: meta = json.load(f)
+        if (meta.get('source') == os.path.abspath(source_path) and meta.get('format') == GUIDE_INDEX_FORMAT
+                and meta.get('aliases') == ALIAS_SIGNATURE):
+            unchanged, meta_dirty = is_source_unchanged(meta, source_path)
+            if unchanged:
+                if meta_dirty: write_json_atomic(index_path, meta)
+                return meta
+    except Exception:
+        pass
+
+    meta = {'source': os.path.abspath(source_path), 'format': GUIDE_INDEX_FORMAT, 'aliases': ALIAS_SIGNATURE,
+            **get_file_signature(source_path), 'sha256': get_file_hash(source_path)}
+    meta['guides'], meta['skipped'] = build_guide_index(source_path)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        write_json_atomic(index_path, meta)
+    except Exception:
+        pass
+    return meta
+
+class GuideStore:
+    def __init__(self, source_path):
+        self.source_path = source_path
+        self.index, self.skipped, self.signature = {}, [], ""
+        if os.path.exists(source_path):
+            meta = load_guide_index(source_path)
+            self.index, self.skipped = meta['guides'], meta['skipped']
+            self.signature = hashlib.sha1(f"{meta['sha256']}:{ALIAS_SIGNATURE}".encode('utf-8')).hexdigest()[:12]
+        self.body_reads = 0
+
+    def __len__(self):
+        return sum(len(decks) for decks in self.index.values())
+
+    def enemies(self):
+        return list(self.index)
+
+    def decks(self, enemy):
+        return list(self.index.get(enemy, {}))
+
+    def has(self, enemy, deck):
+        return deck in self.index.get(enemy, {})
+
+    def summary(self, enemy, deck):
+        return self.index[enemy][deck][2]
+
+    def get(self, enemy, deck):
+        # 본문 한 줄만 위치로 바로 찾아가 읽음
+        offset, length, _ = self.index[enemy][deck]
+        with open(self.source_path, 'rb') as f:
+            f.seek(offset)
+            self.body_reads += 1
+            return json.loads(f.read(length))
+
+    def iter_guides(self):
+        # 전체 본문이 필요한 경우(AI 검색 색인)에만 사용: 파일을 한 번만 열어 인덱스 순서대로 읽음
+        # 공략 파일이 없으면 __init__처럼 빈 저장소로 취급
+        if not self.index or not os.path.exists(self.source_path): return
+        with open(self.source_path, 'rb') as f:
+            for enemy, decks in self.index.items():
+                for deck, (offset, length, _) in decks.items():
+                    f.seek(offset)
+                    self.body_reads += 1
+                    yield (enemy, deck), json.loads(f.read(length))
+
+@st.cache_resource(max_entries=2)
+def load_guide_store(source_path, mtime, size):
+    return GuideStore(source_path)
+
+def get_guide_store():
+    # 매 실행마다 파일 상태(stat)만 확인: 파일이 바뀌면 새 인덱스로 교체되어 예전 위치로 읽지 않음
+    try:
+        sig = get_file_signature(GUIDE_FILE)
+    except OSError:
+        sig = {'mtime': None, 'size': None}
+    return load_guide_store(GUIDE_FILE, sig['mtime'], sig['size'])
+
+# ---------------------------------------------------------
+# [HTML 캐시] 공략/카드 HTML 조각을 한 번만 만들어 재사용
+# 공략은 (공략 데이터 서명, 방덱, 공덱), 카드/세팅 요약은 화면에 들어가는 집계값 자체를 키로 써서
+# 데이터가 바뀌면 키가 달라지고, 같은 값이면 필터가 달라도 같은 조각을 공유합니다.
+# 모든 세션이 함께 쓰는 LRU라 재실행 시 문자열 조립 대신 조회만 합니다.
+# ---------------------------------------------------------
+HTML_CACHE_SIZE = 1024
+
+@st.cache_resource
+def get_html_cache():
+    return LRUCache(HTML_CACHE_SIZE)
+
+def get_guide_html(guide_store, enemy_name, my_deck_name):
+    return get_html_cache().get_or_create(('guide', guide_store.signature, enemy_name, my_deck_name),
+                                          lambda: clean_html(generate_guide_html(enemy_name, my_deck_name, guide_store.get(enemy_name, my_deck_name))))
+
+def get_card_html(defense_team, match_count, best_atk_team, best):
+    key = ('card', defense_team, match_count, best_atk_team, best['count'], best['pet'], best['pet_count'], best['skill'], best['skill_count'], best['speed_html'])
+    return get_html_cache().get_or_create(key, lambda: build_card_html(defense_team, match_count, best_atk_team, best))
+
+def get_setting_html(summary):
+    key = ('setting', summary['pet'], summary['pet_count'], summary['skill'], summary['skill_count'], summary['speed_html'])
+    return get_html_cache().get_or_create(key, lambda: build_setting_html(summary))
+
+@st.cache_resource(max_entries=2)
+def get_guide_search_index(guide_signature, _enemies):
+    return HeroSearchIndex(_enemies)
+
+# st.dialog는 자체적으로 프래그먼트처럼 동작하므로 팝업 안의 상호작용은 팝업만 다시 그림
 @st.dialog("📖 매치업 상세 공략", width="large")
-def show_guide_popup(enemy_name, my_deck_name, guide):
-    html_content = generate_guide_html(enemy_name, my_deck_name, guide)
-    st.markdown(clean_html(html_content), unsafe_allow_html=True)
+def show_guide_popup(enemy_name, my_deck_name):
+    st.markdown(get_guide_html(get_guide_store(), enemy_name, my_deck_name), unsafe_allow_html=True)
+
+# ---------------------------------------------------------
+# [개체 추출] 영웅/별칭/길드/날짜 이름을 한 번에 찾는 Aho-Corasick 매처
+# 모든 이름을 하나의 오토마톤으로 미리 컴파일해 두고 질문을 한 번만 훑어 언급된 개체를 모두 찾습니다.
+# 부분 문자열 매칭이라 조사가 붙은 이름("프레이야로")도 인식되며, 더 긴 이름 안에 포함된
+# 짧은 이름(예: '리나' 안의 '리')은 같은 위치의 긴 이름이 있으면 제외합니다.
+# ---------------------------------------------------------
+class EntityMatcher:
+    def __init__(self, patterns):
+        # patterns: [(찾을 문자열, 개체 종류, 대표 이름)] - 등록 순서가 결과 순서
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for order, (text, kind, name) in enumerate(patterns):
+            if not text: continue
+            state = 0
+            for ch in text:
+                if ch not in self._goto[state]:
+                    self._goto.append({}); self._fail.append(0); self._out.append([])
+                    self._goto[state][ch] = len(self._goto) - 1
+                state = self._goto[state][ch]
+            self._out[state].append((len(text), kind, name, order))
+        # BFS로 실패 링크 구성 (깊이 1 노드의 실패 링크는 루트)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                if state == 0: continue
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]: fallback = self._fail[fallback]
+                self._fail[nxt] = self._goto[fallback].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find(self, text):
+        matches, state = [], 0
+        for pos, ch in enumerate(text):
+            while state and ch not in self._goto[state]: state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            for length, kind, name, order in self._out[state]:
+                matches.append((pos - length + 1, pos + 1, kind, name, order))
+        return matches
+
+    def longest_matches(self, text):
+        matches = self.find(text)
+        return [m for m in matches if not any(o[0] <= m[0] and m[1] <= o[1] and (o[1] - o[0]) > (m[1] - m[0]) for o in matches)]
+
+    def extract(self, text):
+        entities = {'hero': [], 'guild': [], 'date': []}
+        for _, _, kind, name, _ in sorted(self.longest_matches(text), key=lambda m: m[4]):
+            if name not in entities[kind]: entities[kind].append(name)
+        return entities
+
+    def canonicalize(self, text):
+        # 찾은 이름을 앞에서부터 대표 이름으로 바꿈 (겹치는 구간은 앞선 이름, 같은 구간은 먼저 등록된 이름 우선)
+        parts, pos = [], 0
+        for start, end, _, name, _ in sorted(self.longest_matches(text), key=lambda m: (m[0], m[4])):
+            if start < pos: continue
+            parts += [text[pos:start], name]
+            pos = end
+        return "".join(parts) + text[pos:]
+
+def build_entity_matcher(hero_names, guild_names, dates):
+    patterns = [(h, 'hero', h) for h in hero_names]
+    patterns += [(alias, 'hero', canonical) for alias, canonical in HERO_ALIASES.items() if canonical in hero_names]
+    for g in guild_names:
+        patterns.append((g, 'guild', g))
+        short_name = g.replace('길드', '').strip()
+        if short_name and short_name != g: patterns.append((short_name, 'guild', g))
+    patterns += [(d, 'date', d) for d in dates]
+    return EntityMatcher(patterns)
+
+# ---------------------------------------------------------
+# [AI 검색 인덱스] 질문 관련도 점수를 행 단위 반복 없이 계산
+# 행별 영웅 비트마스크와 길드 코드를 데이터 버전마다 한 번 만들어 두고
+# 질문마다 NumPy 벡터 연산으로 점수를 매깁니다. (가중치: 길드 50, 영웅 교차 10/단독 5)
+# 길드/영웅이 없는 일반 질문은 아래 BM25 검색 인덱스가 담당합니다.
+# ---------------------------------------------------------
+AI_STOPWORDS = ['길드', '방어덱', '공격덱', '어때', '알려줘']
+
+class AiSearchIndex:
+    def __init__(self, df):
+        self.hero_ids = df.attrs.get('hero_ids') or build_hero_ids([df['방어팀_정렬'], df['공격팀_정렬']])
+        self.def_masks = self._team_masks(df, '방어팀_정렬')
+        self.atk_masks = self._team_masks(df, '공격팀_정렬')
+        guild = df['상대 길드'] if isinstance(df['상대 길드'].dtype, pd.CategoricalDtype) else df['상대 길드'].astype(str).astype('category')
+        self.guild_codes = guild.cat.codes.to_numpy()
+        self.guild_names = [str(g) for g in guild.cat.categories]
+        guilds = [str(g) for g in df['상대 길드'].unique() if str(g).strip()]
+        dates = [str(d) for d in df['날짜'].unique() if str(d).strip() and str(d) != 'Unknown']
+        self.entities = build_entity_matcher(list(self.hero_ids), guilds, dates)
+
+    def _team_masks(self, df, team_col):
+        if f"{team_col}{MASK_SUFFIX}0" in df.columns: return get_team_masks(df, team_col)
+        return encode_team_masks(df[team_col], self.hero_ids)
+
+    def count_hero_matches(self, masks, heroes):
+        # 팀 문자열 부분일치와 같은 규칙: 질문 영웅 이름을 포함하는 모든 영웅을 하나의 마스크로
+        counts = np.zeros(len(masks), dtype=np.int64)
+        for h in heroes:
+            hero_mask = heroes_to_mask([name for name in self.hero_ids if h in name], self.hero_ids)
+            counts += (masks & hero_mask).any(axis=1)
+        return counts
+
+    def score(self, guilds, heroes):
+        score = np.zeros(len(self.guild_codes), dtype=np.int64)
+        # (1) 길드 매칭 점수 (최우선순위)
+        if guilds:
+            guild_hit = np.array([any(g in name for g in guilds) for name in self.guild_names] + [False])
+            score += 50 * guild_hit[self.guild_codes]  # 코드 -1(결측)은 마지막 False로
+        # (2) 영웅 교차 매칭 점수: 오공(방) vs 프레이야(공)는 10점씩, 한쪽만 맞으면 5점씩
+        def_matches = self.count_hero_matches(self.def_masks, heroes)
+        atk_matches = self.count_hero_matches(self.atk_masks, heroes)
+        score += np.where((def_matches > 0) & (atk_matches > 0), (def_matches + atk_matches) * 10, np.where(atk_matches > 0, atk_matches * 5, def_matches * 5))
+        return score
+
+@st.cache_resource(max_entries=4)
+def get_ai_index(data_version, _df):
+    return AiSearchIndex(_df)
 
 # ---------------------------------------------------------
-# [중요] AI 데이터 요약 함수 (검색 및 매칭 로직 강화)
+# [BM25 검색] 전적 기록 / 매치업 요약 / 수동 공략 텍스트 검색 인덱스
+# 한국어는 형태소 분석 없이 단어 + 글자 2-gram으로 토큰화하여 조사가 붙은 단어도 매칭되게 하고,
+# 토큰 -> (문서 ID 배열, BM25 가중치 배열) 형태의 희소 역색인을 미리 만들어 질문마다 top-k만 뽑습니다.
 # ---------------------------------------------------------
-def get_ai_context(df, matchup_db, user_query=""):
+SEARCH_SPLIT_PATTERN = re.compile(r"[\s,./()\[\]<>:;!?\"'~\-+*=|]+")
+HTML_TAG_PATTERN = re.compile(r"<[^>]+>")
+GUIDE_TOP_K = 5
+GUIDE_MIN_SCORE_RATIO = 0.3  # 1위 점수 대비 이 비율 미만인 공략은 관련 없다고 보고 제외
+GUIDE_MIN_SCORE = 2.0  # 글자 2-gram 한두 개만 겹친 우연한 매칭 제외
+MATCHUP_TOP_K = 5
+
+def tokenize_for_search(text):
+    tokens = []
+    for word in SEARCH_SPLIT_PATTERN.split(HTML_TAG_PATTERN.sub(" ", str(text)).lower()):
+        if not word: continue
+        tokens.append(word)
+        if len(word) > 2: tokens += [word[i:i + 2] for i in range(len(word) - 1)]
+    return tokens
+
+class BM25Index:
+    def __init__(self, docs, k1=1.5, b=0.75):
+        doc_tokens = [tokenize_for_search(d) for d in docs]
+        self.size = len(docs)
+        lengths = np.array([len(t) for t in doc_tokens], dtype=np.float64)
+        avg_len = lengths.mean() if self.size and lengths.mean() > 0 else 1.0
+        term_docs = {}
+        for doc_id, tokens in enumerate(doc_tokens):
+            for term, tf in Counter(tokens).items(): term_docs.setdefault(term, []).append((doc_id, tf))
+        self.postings = {}
+        for term, entries in term_docs.items():
+            ids = np.array([d for d, _ in entries], dtype=np.int64)
+            tfs = np.array([tf for _, tf in entries], dtype=np.float64)
+            idf = np.log(1 + (self.size - len(ids) + 0.5) / (len(ids) + 0.5))
+            self.postings[term] = (ids, idf * tfs * (k1 + 1) / (tfs + k1 * (1 - b + b * lengths[ids] / avg_len)))
+
+    def search(self, query, k=10):
+        scores = np.zeros(self.size)
+        for term, qtf in Counter(tokenize_for_search(query)).items():
+            if term in self.postings:
+                ids, weights = self.postings[term]
+                scores[ids] += qtf * weights
+        hits = np.flatnonzero(scores > 0)
+        if not len(hits): return []
+        top = hits[np.argsort(-scores[hits], kind='stable')[:k]]
+        return [(int(i), float(scores[i])) for i in top]
+
+class AiRetrievalIndex:
+    def __init__(self, df, guide_store):
+        row_cols = ['방어팀_정렬', '공격팀_정렬', '방어팀 펫', '방어팀 스순', '공격팀 펫', '공격팀 스순', '속공', '상대 길드', '날짜', '기준']
+        row_text = df[row_cols[0]].astype(str)
+        for col in row_cols[1:]: row_text = row_text + " " + df[col].astype(str)
+        self.rows = BM25Index(row_text.tolist())
+
+        # 매치업 요약: (방어덱, 공격덱) 단위로 집계된 대표 세팅
+        summaries = build_matchup_index(df).summaries
+        self.matchup_keys = list(summaries.keys())
+        self.matchup_summaries = [summaries[key] for key in self.matchup_keys]
+        self.matchups = BM25Index([f"{d} {d} {a} {a} {s['pet']} {s['skill']}" for (d, a), s in summaries.items()])
+
+        # 수동 공략: 방덱/공덱 이름은 가중치를 높이기 위해 반복해서 넣음
+        self.guide_keys, guide_docs = [], []
+        for (enemy, deck), info in guide_store.iter_guides():
+            setting = info.get('my_setting', '')
+            if isinstance(setting, list): setting = " ".join(f"{item.get('name', '')} {item.get('desc', '')}" for item in setting)
+            self.guide_keys.append((enemy, deck))
+            guide_docs.append(" ".join([enemy] * 3 + [deck] * 2 + [str(info.get(f, '')) for f in ('summary', 'enemy_info', 'operate_tips')] + [str(setting)]))
+        self.guides = BM25Index(guide_docs)
+
+    def search_rows(self, query, k=50):
+        return self.rows.search(query, k)
+
+    def search_matchups(self, query, k=MATCHUP_TOP_K):
+        return [(self.matchup_keys[i], self.matchup_summaries[i], score) for i, score in self.matchups.search(query, k)]
+
+    def search_guides(self, query, k=GUIDE_TOP_K):
+        hits = self.guides.search(query, k)
+        if not hits: return []
+        cutoff = max(hits[0][1] * GUIDE_MIN_SCORE_RATIO, GUIDE_MIN_SCORE)
+        return [self.guide_keys[i] for i, score in hits if score >= cutoff]
+
+@st.cache_resource(max_entries=4)
+def get_retrieval_index(data_version, guide_signature, _df, _guide_store):
+    return AiRetrievalIndex(_df, _guide_store)
+
+def build_search_query(raw_keywords, heroes, guilds):
+    # 불용어를 빼고, 별칭은 대표 이름으로 바꿔 검색어에 추가
+    words = [k for k in raw_keywords if k not in AI_STOPWORDS and k not in ['덱']]
+    return " ".join(words + list(heroes) + list(guilds))
+
+# ---------------------------------------------------------
+# [컨텍스트 예산] 프롬프트 토큰 수를 추정하고 관련도 순으로 예산 안에서 채움
+# 섹션마다 우선순위를 두고 우선순위가 높은 섹션의 항목(관련도 순)부터 예산을 채운 뒤,
+# 출력은 원래 섹션 순서대로 합칩니다. 예산을 넘는 항목은 생략하고 생략 건수를 끝에 적습니다.
+# ---------------------------------------------------------
+AI_CONTEXT_TOKEN_BUDGET = 2000
+
+def estimate_tokens(text):
+    # 대략적 추정: 한글 등 비ASCII 문자는 글자당 1토큰, 나머지는 4글자당 1토큰 (실제보다 약간 크게 잡음)
+    non_ascii = sum(1 for c in text if ord(c) > 127)
+    return non_ascii + (len(text) - non_ascii + 3) // 4
+
+class ContextBuilder:
+    def __init__(self, budget=AI_CONTEXT_TOKEN_BUDGET):
+        self.budget = budget
+        self.sections = []
+        self.tokens = 0
+        self.dropped = 0
+
+    def section(self, header, priority):
+        # 반환된 리스트에 관련도 높은 항목부터 append
+        lines = []
+        self.sections.append((header, priority, lines))
+        return lines
+
+    def build(self):
+        kept = {}
+        self.tokens, self.dropped = 0, 0
+        for idx in sorted(range(len(self.sections)), key=lambda i: self.sections[i][1]):
+            header, _, lines = self.sections[idx]
+            header_cost = estimate_tokens(header)
+            kept[idx] = []
+            for line in lines:
+                cost = estimate_tokens(line) + 1 + (0 if kept[idx] else header_cost)
+                if self.tokens + cost > self.budget:
+                    self.dropped += 1
+                    continue
+                kept[idx].append(line)
+                self.tokens += cost
+        text = ""
+        for idx, (header, _, _) in enumerate(self.sections):
+            if kept[idx]: text += header + "".join(line + "\n" for line in kept[idx])
+        if self.dropped: text += f"\n(토큰 예산을 넘어 관련도가 낮은 {self.dropped}개 항목 생략)\n"
+        return text
+
+def get_ai_context(df, guide_store, user_query="", ai_index=None, retrieval=None, token_budget=AI_CONTEXT_TOKEN_BUDGET):
     context = "다음은 세븐나이츠 리버스 길드전 승리 데이터입니다. 이 데이터를 바탕으로 질문에 완벽히 답변하세요.\n\n"
     
     if df.empty:
         return context + "현재 로드된 엑셀 데이터가 없습니다."
+    builder = ContextBuilder(max(token_budget - estimate_tokens(context), 0))
         
     # 1. 메타 정보 제공 (데이터베이스의 전체 구조 파악을 위해 길드 및 날짜 정보 제공)
     dates = sorted([d for d in df['날짜'].unique() if d.strip() and d != 'Unknown'], reverse=True)
     guilds = [g for g in df['상대 길드'].unique() if g.strip()]
     
-    context += f"📊 [전체 데이터 메타 정보]\n"
-    context += f"- 총 기록 건수: {len(df)}건\n"
-    if dates: context += f"- 기록된 날짜 범위: {dates[-1]} ~ {dates[0]}\n"
-    if guilds: context += f"- 기록된 상대 길드 목록: {', '.join(guilds)}\n\n"
+    meta = builder.section("📊 [전체 데이터 메타 정보]\n", priority=0)
+    meta.append(f"- 총 기록 건수: {len(df)}건")
+    if dates: meta.append(f"- 기록된 날짜 범위: {dates[-1]} ~ {dates[0]}")
+    if guilds: meta.append(f"- 기록된 상대 길드 목록: {', '.join(guilds)}")
 
     # 2. 질문 키워드 정제
     # 조사를 분리하여 정확한 키워드만 잡을 수 있도록 특수문자 및 공백 처리
     user_query_clean = user_query.replace('?', ' ').replace('!', ' ').replace(',', ' ')
     raw_keywords = [k.strip() for k in user_query_clean.split() if k.strip()]
     
-    # 2-1. 영웅 이름 추출
-    all_heroes = set()
-    for col in ['방어팀_정렬', '공격팀_정렬']:
-        for items in df[col].dropna():
-            for h in items.split(','):
-                all_heroes.add(h.strip())
-                
-    # 질문에 존재하는 영웅 이름만 추출 (예: "프레이야로" -> "프레이야" 인식)
-    extracted_heroes = [h for h in all_heroes if h in user_query_clean]
-    expanded_heroes = expand_synonyms(extracted_heroes)
-    
-    # 2-2. 길드명 추출 (질문 내 포함 여부 확인)
-    # 길드 목록에 있는 이름이 질문에 포함되었거나, '길드'를 뺀 단어가 포함된 경우
-    extracted_guilds = [g for g in guilds if g in user_query_clean or g.replace('길드', '').strip() in user_query_clean]
-
-    # 3. 데이터 스코어링 (관련성 높은 데이터 추출)
-    def calc_score(row):
-        score = 0
-        def_str = str(row.get('방어팀_정렬', ''))
-        atk_str = str(row.get('공격팀_정렬', ''))
-        guild_str = str(row.get('상대 길드', ''))
-        row_all_text = " ".join(row.astype(str).values)
-        
-        # (1) 길드 매칭 점수 (최우선순위)
-        if extracted_guilds:
-            if any(g in guild_str for g in extracted_guilds):
-                score += 50
-                
-        # (2) 영웅 교차 매칭 점수
-        def_matches = sum(1 for h in expanded_heroes if h in def_str)
-        atk_matches = sum(1 for h in expanded_heroes if h in atk_str)
-        
-        if def_matches > 0 and atk_matches > 0:
-            score += (def_matches * 10) + (atk_matches * 10) # 오공(방) vs 프레이야(공)
-        elif atk_matches > 0:
-            score += atk_matches * 5 # 특정 영웅을 공덱으로 썼을 때
-        elif def_matches > 0:
-            score += def_matches * 5 # 특정 영웅 방덱을 상대할 때
-            
-        # (3) 일반 텍스트 매칭 (길드/영웅 추출 실패를 대비한 보험)
-        if not expanded_heroes and not extracted_guilds:
-            for k in raw_keywords:
-                if len(k) > 1 and k not in ['길드', '방어덱', '공격덱', '어때', '알려줘']:
-                    if k in row_all_text:
-                        score += 2
-                        
-        return score
+    # 2-1. 영웅/길드 이름 추출 (미리 컴파일한 매처로 질문을 한 번만 훑음)
+    # 영웅: "프레이야로" -> "프레이야", 별칭 '쁘' -> '브브' / 길드: 이름 또는 '길드'를 뺀 이름
+    if ai_index is None: ai_index = AiSearchIndex(df)
+    entities = ai_index.entities.extract(user_query_clean)
+    expanded_heroes = entities['hero']
+    extracted_guilds = entities['guild']
 
-    temp_df = df.copy()
-    temp_df['score'] = temp_df.apply(calc_score, axis=1)
+    if retrieval is None: retrieval = AiRetrievalIndex(df, guide_store)
+    search_query = build_search_query(raw_keywords, expanded_heroes, extracted_guilds)
+
+    # 3. 데이터 스코어링 (관련성 높은 데이터 추출) - 데이터 버전별로 미리 만든 인덱스로 벡터 연산
+    # 길드/영웅이 있으면 구조화된 가중치 점수, 없으면 BM25 점수로 관련 기록을 고름
+    if expanded_heroes or extracted_guilds:
+        scores = pd.Series(ai_index.score(extracted_guilds, expanded_heroes), index=df.index)
+    else:
+        score_values = np.zeros(len(df))
+        for row_id, row_score in retrieval.search_rows(search_query): score_values[row_id] = row_score
+        scores = pd.Series(score_values, index=df.index)
     
-    # 0점 이상인 관련 데이터 추출 및 정렬 (최대 50건까지만 컨텍스트에 포함)
-    relevant_df = temp_df[temp_df['score'] > 0].sort_values(by='score', ascending=False)
+    # 0점 이상인 관련 데이터 추출 및 정렬 (최대 50건까지만 후보로 사용)
+    relevant_df = df[scores > 0].assign(score=scores[scores > 0]).sort_values(by='score', ascending=False)
     
-    # 4. 컨텍스트 텍스트 생성 [수정된 부분: 방어팀 스순, 펫 정보 포함]
+    # 4. 컨텍스트 텍스트 생성 - 반복되는 세팅 줄은 표 한 줄로 압축
     if not relevant_df.empty:
         analyzed_df = relevant_df.head(50)
-        context += f"🎯 [질문과 직접 관련된 핵심 데이터 {len(analyzed_df)}건 추출됨]\n"
+        builder.section("", priority=0).append(f"🎯 [질문과 직접 관련된 핵심 데이터 {len(analyzed_df)}건 추출됨]")
         
-        # 길드 정보 요약
+        # 길드 정보 요약 (방어덱 하나당 한 항목)
         if extracted_guilds:
             for g in extracted_guilds:
                 g_df = analyzed_df[analyzed_df['상대 길드'].astype(str).str.contains(g)]
                 if not g_df.empty:
-                    context += f"🏰 [상대 길드 '{g}'의 주요 방어덱 및 카운터 정보]\n"
-                    top_defs = g_df['방어팀_정렬'].value_counts().head(3)
+                    guild_lines = builder.section(f"🏰 [상대 길드 '{g}'의 주요 방어덱 및 카운터 정보]\n", priority=1)
+                    top_defs = get_value_counts(g_df['방어팀_정렬']).head(3)
                     for d_name, d_cnt in top_defs.items():
                         sub_df = g_df[g_df['방어팀_정렬'] == d_name]
                         def_pet, _ = get_mode(sub_df['방어팀 펫'])
                         def_skill, _ = get_mode(sub_df['방어팀 스순'])
                         
-                        context += f"  - 방어덱: [{d_name}] (방어 펫: {def_pet}, 방어 스순: {def_skill} / {d_cnt}회 등장)\n"
-                        
-                        top_atks = sub_df['공격팀_정렬'].value_counts().head(2)
+                        item = f"  - 방어덱: [{d_name}] (방어 펫: {def_pet}, 방어 스순: {def_skill} / {d_cnt}회 등장)"
+                        top_atks = get_value_counts(sub_df['공격팀_정렬']).head(2)
                         for a_name, a_cnt in top_atks.items():
-                            context += f"    > 카운터 공덱: [{a_name}] ({a_cnt}회 승리)\n"
-                    context += "\n"
+                            item += f"\n    > 카운터 공덱: [{a_name}] ({a_cnt}회 승리)"
+                        guild_lines.append(item)
                     
-        # 매치업(영웅) 정보 요약
+        # 매치업(영웅) 정보 요약 - 승리 횟수, 관련도 순으로 예산이 허락하는 만큼
+        shown_pairs = set()
         if expanded_heroes or (not extracted_guilds and not expanded_heroes):
-            patterns = analyzed_df.groupby(['방어팀_정렬', '공격팀_정렬']).size().reset_index(name='count')
-            patterns = patterns.sort_values('count', ascending=False).head(10)
+            patterns = analyzed_df.groupby(['방어팀_정렬', '공격팀_정렬'], observed=True)['score'].agg(['size', 'sum']).reset_index()
+            patterns = patterns.sort_values(['size', 'sum'], ascending=False)
             
-            context += "⚔️ [가장 많이 사용된 승리 매치업 상세 정보]\n"
-            for _, row in patterns.iterrows():
-                context += f"- 상대 방어팀: [{row['방어팀_정렬']}]  VS  우리 공격팀: [{row['공격팀_정렬']}] (총 {row['count']}회 승리)\n"
-                
+            pattern_rows = builder.section(
+                "⚔️ [가장 많이 사용된 승리 매치업 상세 정보]\n"
+                "| 상대 방어팀 | 우리 공격팀 | 승리 | 방어 펫 | 방어 스순 | 공격 펫 | 공격 스순 | 속공 |\n"
+                "|---|---|---|---|---|---|---|---|\n", priority=3)
+            for d_name, a_name, cnt, _ in patterns.itertuples(index=False):
                 # 상세 세팅 추출 (방어팀, 공격팀 모두 포함)
-                subset = analyzed_df[(analyzed_df['방어팀_정렬'] == row['방어팀_정렬']) & (analyzed_df['공격팀_정렬'] == row['공격팀_정렬'])]
-                def_pet, _ = get_mode(subset['방어팀 펫'])
-                def_skill, _ = get_mode(subset['방어팀 스순'])
-                atk_pet, _ = get_mode(subset['공격팀 펫'])
-                atk_skill, _ = get_mode(subset['공격팀 스순'])
-                speed, _ = get_mode(subset['속공'])
-                
-                context += f"    > 🛡️ [방어팀 세팅] 펫: {def_pet}, 스킬순서: {def_skill}\n"
-                context += f"    > ⚔️ [공격팀 세팅] 펫: {atk_pet}, 스킬순서: {atk_skill}, 속공: {speed}\n"
+                subset = analyzed_df[(analyzed_df['방어팀_정렬'] == d_name) & (analyzed_df['공격팀_정렬'] == a_name)]
+                settings = [get_mode(subset[col])[0] for col in ['방어팀 펫', '방어팀 스순', '공격팀 펫', '공격팀 스순', '속공']]
+                pattern_rows.append(f"| {d_name} | {a_name} | {cnt} | " + " | ".join(settings) + " |")
+                shown_pairs.add((d_name, a_name))
+        # 일반 질문이면 전체 데이터에서 비슷한 매치업 요약도 함께 제공 (위 표와 겹치는 매치업 제외)
+        if not expanded_heroes and not extracted_guilds:
+            similar_rows = builder.section(
+                "\n🔎 [질문과 비슷한 매치업 요약 (전체 데이터 기준)]\n"
+                "| 상대 방어팀 | 우리 공격팀 | 승리 | 공격 펫 | 공격 스순 |\n"
+                "|---|---|---|---|---|\n", priority=4)
+            for (d_name, a_name), summary, _ in retrieval.search_matchups(search_query):
+                if (d_name, a_name) in shown_pairs: continue
+                similar_rows.append(f"| {d_name} | {a_name} | {summary['count']} | {summary['pet']} | {summary['skill']} |")
     else:
-        context += "⚠️ 질문하신 내용(길드, 영웅, 특정 날짜 등)에 정확히 일치하는 기록을 엑셀 데이터에서 찾지 못했습니다.\n"
-        top_atk = df['공격팀_정렬'].value_counts().head(5)
-        context += f"[참고: 전체 통계상 가장 강력한 공덱 Top 5]\n"
-        for atk, cnt in top_atk.items():
-            context += f"- {atk} ({cnt}회 승리)\n"
-
-    # 5. 수동 공략 (Matchup DB) 연동
-    if matchup_db:
-        context += "\n📖 [수동 공략 데이터베이스 가이드]\n"
-        found_guide = False
-        for enemy, guides in matchup_db.items():
-            if any(k in enemy for k in expanded_heroes) or any(k in enemy for k in raw_keywords if len(k)>1 and k not in ['길드', '덱']):
-                for atk, info in guides.items():
-                    context += f"- VS 방어덱 [{enemy}] -> 추천 공덱 [{atk}]\n"
-                    context += f"  * 핵심 요약: {info.get('summary')}\n"
-                found_guide = True
-        if not found_guide: context += "(관련 상세 가이드 없음)\n"
-
-    return context
+        fallback = builder.section(
+            "⚠️ 질문하신 내용(길드, 영웅, 특정 날짜 등)에 정확히 일치하는 기록을 엑셀 데이터에서 찾지 못했습니다.\n"
+            "[참고: 전체 통계상 가장 강력한 공덱 Top 5]\n", priority=3)
+        for atk, cnt in get_value_counts(df['공격팀_정렬']).head(5).items():
+            fallback.append(f"- {atk} ({cnt}회 승리)")
+
+    # 5. 수동 공략 (Matchup DB) 연동 - 질문 영웅이 들어간 방덱 공략 + BM25 top-k
+    if guide_store:
+        guide_lines = builder.section("\n📖 [수동 공략 데이터베이스 가이드]\n", priority=2)
+        guide_hits = [(enemy, atk) for enemy in guide_store.enemies() if any(h in enemy for h in expanded_heroes) for atk in guide_store.decks(enemy)]
+        guide_hits += [key for key in retrieval.search_guides(search_query) if key not in guide_hits]
+        for enemy, atk in guide_hits:
+            guide_lines.append(f"- VS 방어덱 [{enemy}] -> 추천 공덱 [{atk}]\n  * 핵심 요약: {guide_store.summary(enemy, atk)}")
+        if not guide_hits: guide_lines.append("(관련 상세 가이드 없음)")
+
+    return context + builder.build()
+
+# ---------------------------------------------------------
+# [AI 응답 캐시] 같은 질문은 Gemini를 다시 부르지 않고 저장된 답변으로 즉시 응답
+# 키: 질문의 단어를 순서대로 (영웅/길드/날짜는 대표 이름으로, 조사와 방덱/공덱은 그대로) + 데이터 내용 ID + 모델 이름
+# 누가 방어덱이고 누가 공격덱인지는 어순과 조사로 정해지므로 정렬하지 않습니다.
+# 모든 세션이 공유하고(cache_resource), 디스크(.data_cache)에 저장되어 재시작 후에도 유지됩니다.
+# TTL이 지난 답변은 버리고, 개수가 넘치면 가장 오래 안 쓰인 답변부터 제거합니다.
+# ---------------------------------------------------------
+AI_RESPONSE_CACHE_PATH = os.path.join(CACHE_DIR, "ai_responses.json")
+AI_RESPONSE_CACHE_SIZE = 500
+AI_RESPONSE_TTL_SEC = 24 * 60 * 60
+AI_KEY_FILLER_WORDS = [w for w in AI_STOPWORDS if w not in ('방어덱', '공격덱')]  # 키에서 빼도 뜻이 같은 단어
+
+class ResponseCache:
+    def __init__(self, path, maxsize, ttl):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_sec = 0.0
+        try:
+            with open(path, encoding='utf-8') as f:
+                for entry in json.load(f): self._data[entry['key']] = entry
+        except (OSError, ValueError, KeyError, TypeError):
+            self._data.clear()
+
+    def _lookup(self, key):
+        # 잠금 안에서 호출. 적중/미스는 세지 않음
+        entry = self._data.get(key)
+        if entry is not None and time.time() - entry['created'] > self.ttl:
+            del self._data[key]
+            entry = None
+        return entry
+
+    def get(self, keys):
+        # 같은 질문의 후보 키(모델별)를 순서대로 찾아 처음 찾은 답변 반환. 질문 하나당 적중/미스 한 번만 셈
+        with self._lock:
+            for key in keys:
+                entry = self._lookup(key)
+                if entry is not None:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    self.saved_sec += entry['elapsed']
+                    return entry['response']
+            self.misses += 1
+            return None
+
+    def put(self, key, response, elapsed):
+        with self._lock:
+            self._data[key] = {'key': key, 'response': response, 'created': time.time(), 'elapsed': elapsed}
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize: self._data.popitem(last=False)
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                write_json_atomic(self.path, list(self._data.values()))
+            except OSError:
+                pass  # 디스크 저장 실패 시에도 메모리 캐시는 계속 사용
+
+    def __len__(self):
+        return len(self._data)
+
+@st.cache_resource
+def get_response_cache():
+    return ResponseCache(AI_RESPONSE_CACHE_PATH, AI_RESPONSE_CACHE_SIZE, AI_RESPONSE_TTL_SEC)
+
+def make_response_key(content_id, model_name, user_query, ai_index):
+    # 별칭만 대표 이름으로 바꾸고 어순/조사는 유지
+    # ("쁘 방덱 스순 알려줘" == "브브 방덱 스순", "오공 방덱을 프레이야로" != "프레이야 방덱을 오공으로")
+    query_clean = user_query.replace('?', ' ').replace('!', ' ').replace(',', ' ')
+    words = [ai_index.entities.canonicalize(w) for w in query_clean.split() if w not in AI_KEY_FILLER_WORDS]
+    return json.dumps([content_id, model_name, words], ensure_ascii=False)
+
+# ---------------------------------------------------------
+# [AI 스트리밍] Gemini 답변을 받는 대로 모아 채팅창에 출력
+# 요청마다 제한 시간을 두고, 제한 시간을 넘기거나 질문한 사용자가 화면을 떠나면
+# 진행 중인 스트림을 취소합니다.
+# ---------------------------------------------------------
+AI_REQUEST_TIMEOUT_SEC = 90
+
+def open_ai_stream(model, full_prompt, timeout=AI_REQUEST_TIMEOUT_SEC):
+    # 재시도는 클라이언트 내부가 아니라 모델 라우터가 담당 (실패를 바로 알아야 다음 모델로 넘어감)
+    return model.generate_content(full_prompt, stream=True, request_options={'timeout': timeout, 'retry': None})
+
+def cancel_ai_stream(stream):
+    # google-generativeai 스트림 응답에는 공개 취소 API가 없어 내부 gRPC 반복자를 직접 취소
+    cancel = getattr(getattr(stream, '_iterator', None), 'cancel', None)
+    if callable(cancel):
+        try: cancel()
+        except Exception: pass
+
+def stream_ai_text(stream, deadline, chunks, is_cancelled=lambda: False):
+    finished = False
+    try:
+        for chunk in stream:
+            if time.time() > deadline: raise TimeoutError(f"응답 제한 시간 {AI_REQUEST_TIMEOUT_SEC}초 초과")
+            if is_cancelled(): raise InterruptedError("질문한 사용자가 화면을 떠나 답변 생성을 취소했습니다")
+            text = chunk.text
+            if text:
+                chunks.append(text)
+                yield text
+        finished = True
+    finally:
+        if not finished: cancel_ai_stream(stream)
+
+def build_ai_prompt(data_context, question, history_summary=""):
+    # 지시문 + 데이터를 앞에, 매 턴 바뀌는 이전 대화 요약/질문은 맨 뒤에 둠
+    history_block = f"""
+    [이전 대화 요약] (후속 질문은 이 흐름을 이어서 답해줘)
+    {history_summary}
+    """ if history_summary else ""
+    return f"""
+    너는 '세븐나이츠 리버스' 게임의 길드전 전략 전문가야.
+    아래 제공된 [길드전 데이터]를 바탕으로 사용자의 질문에 완벽히 답변해줘.
+    
+    [답변 원칙]
+    1. **분석된 데이터** (방어팀 세팅, 공격팀 세팅 등)를 최우선 근거로 제시해.
+    2. 사용자가 '방어팀의 스킬 순서'나 '방어덱 세팅'을 물어봤다면 제공된 데이터 표의 [방어 펫], [방어 스순] 값을 기반으로 구체적으로 답변해줘. (이제 데이터에 방어팀 스순 정보가 포함되어 있어!)
+    3. 사용자가 특정 매치업을 물어봤다면, 방어팀과 공격팀의 펫, 스순, 속공 등을 종합적으로 비교해서 알려줘.
+    4. 답변은 친절하고 간결하게, 가독성 좋게 마크다운으로 정리해줘.
+
+    [길드전 데이터]
+    {data_context}
+    {history_block}
+    사용자 질문: {question}
+    """
+
+def describe_ai_error(error):
+    if isinstance(error, queue.Full):
+        return "⏳ 지금 AI 질문이 몰려 대기열이 가득 찼습니다. 잠시 후 다시 질문해주세요."
+    if type(error).__name__ in ('ResourceExhausted', 'TooManyRequests') or '429' in str(error):
+        return f"⏳ AI 사용량 한도에 걸렸습니다. 잠시 후 다시 질문해주세요. (에러 원인: {error})"
+    if isinstance(error, InterruptedError):
+        return f"⏹️ 답변 생성이 취소되었습니다. ({error})"
+    if isinstance(error, TimeoutError):
+        return f"⌛ AI 응답 시간이 초과되었습니다. 질문을 조금 더 구체적으로 해주세요. (에러 원인: {error})"
+    return f"🚫 모든 AI 모델 연결 실패. 최신 패키지(`pip install --upgrade google-generativeai`) 설치가 필요합니다. (에러 원인: {error})"
+
+# ---------------------------------------------------------
+# [모델 라우팅] 모델별 지연/오류율을 기록하고 느린 요청에는 다음 모델로 헤지 요청
+# 모델마다 최근 AI_STATS_WINDOW건의 첫 응답 지연(TTFT)과 성공 여부를 모아 두고,
+# 오류가 잦은 모델은 뒤로, 나머지는 지연 중앙값이 짧은 순으로 시도합니다.
+# 첫 요청이 그 모델의 지연 상위 백분위(AI_HEDGE_PERCENTILE)를 넘도록 첫 응답이 없으면 다음 모델에도
+# 요청을 보내(헤지) 먼저 첫 응답을 준 쪽을 채택하고 나머지는 취소합니다.
+# 헤지/대체 요청도 첫 요청과 똑같이 동시 호출 자리(AI_MAX_CONCURRENCY)와 토큰 버킷을 거쳐야 나갑니다.
+# 로컬 가짜 서버로 점검할 때는 secrets의 GEMINI_API_ENDPOINT로 API 주소를 바꿉니다. (tests/fake_gemini.py)
+# ---------------------------------------------------------
+AI_STATS_WINDOW = 50
+AI_HEDGE_PERCENTILE = 90
+AI_HEDGE_MIN_SAMPLES = 5
+AI_HEDGE_DEFAULT_DELAY_SEC = 8.0  # 표본이 부족할 때 헤지까지 기다리는 시간
+AI_HEDGE_MIN_DELAY_SEC = 1.0
+AI_ERROR_RATE_DEMOTE = 0.5  # 최근 오류율이 이 이상이면 순서를 뒤로 미룸
+
+class ModelStats:
+    def __init__(self, window=AI_STATS_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.requests = 0
+        self.hedges = 0
+        self.wins = 0
+        self._lock = threading.Lock()
+
+    def record(self, ok, latency=None):
+        with self._lock:
+            self.outcomes.append(ok)
+            if ok and latency is not None: self.latencies.append(latency)
+
+    def percentile(self, p):
+        with self._lock: samples = list(self.latencies)
+        return float(np.percentile(samples, p)) if samples else None
+
+    @property
+    def error_rate(self):
+        with self._lock: outcomes = list(self.outcomes)
+        return outcomes.count(False) / len(outcomes) if outcomes else 0.0
+
+class ModelRouter:
+    def __init__(self, bucket=None, slots=None):
+        self.bucket = bucket
+        self.slots = slots  # 실제 진행 중인 모델 호출 수 제한 (threading.BoundedSemaphore)
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def get_stats(self, model_name):
+        with self._lock:
+            if model_name not in self.stats: self.stats[model_name] = ModelStats()
+            return self.stats[model_name]
+
+    def order(self, models):
+        # 지연 기록이 없는 모델은 기본 헤지 대기 시간만큼 걸린다고 보고, 같으면 설정 순서대로
+        def sort_key(item):
+            idx, name = item
+            stats = self.get_stats(name)
+            p50 = stats.percentile(50)
+            return (stats.error_rate >= AI_ERROR_RATE_DEMOTE, AI_HEDGE_DEFAULT_DELAY_SEC if p50 is None else p50, idx)
+        return [name for _, name in sorted(enumerate(models), key=sort_key)]
+
+    def hedge_delay(self, model_name):
+        stats = self.get_stats(model_name)
+        if len(stats.latencies) < AI_HEDGE_MIN_SAMPLES: return AI_HEDGE_DEFAULT_DELAY_SEC
+        return max(stats.percentile(AI_HEDGE_PERCENTILE), AI_HEDGE_MIN_DELAY_SEC)
+
+    def admit(self, deadline):
+        # 동시 호출 자리 -> 토큰 순으로 확보. 토큰을 못 얻으면 자리를 돌려줌 (deadline이 지금이면 기다리지 않음)
+        if self.slots is not None and not self.slots.acquire(timeout=max(deadline - time.time(), 0)): return False
+        if self.bucket is not None and not self.bucket.acquire(deadline):
+            if self.slots is not None: self.slots.release()
+            return False
+        return True
+
+    def run(self, job, deadline):
+        # job.chunks를 먼저 첫 응답을 준 모델의 출력으로 바꿔 끼우고 그 모델 이름을 반환
+        pending = self.order(job.models)
+        state = {'winner': None, 'errors': {}}
+        state_lock = threading.Lock()
+        attempts = []  # [(모델 이름, 스레드, 시작 시각, 시도 상태)]
+
+        def attempt(model_name, handle):
+            stats = self.get_stats(model_name)
+            local_chunks, started, first_at = [], time.time(), None
+            try:
+                # SDK는 첫 조각을 받은 뒤에야 스트림을 돌려주므로, 그 전에 졌으면 받는 즉시 닫음
+                stream = open_ai_stream(genai.GenerativeModel(model_name), job.full_prompt, max(deadline - started, 1))
+                handle['stream'] = stream
+                if handle['cancelled']:
+                    cancel_ai_stream(stream)
+                    return
+                for _ in stream_ai_text(stream, deadline, local_chunks, lambda: job.is_abandoned() or handle['cancelled']):
+                    if first_at is None:
+                        first_at = time.time()
+                        stats.record(True, first_at - started)
+                        with state_lock:
+                            if state['winner'] is None:
+                                state['winner'] = model_name
+                                job.chunks = local_chunks
+            except Exception as e:
+                if handle['cancelled']: return  # 다른 모델이 채택되어 취소된 시도는 오류로 세지 않음
+                if first_at is None: stats.record(False)
+                state['errors'][model_name] = e
+            finally:
+                if self.slots is not None: self.slots.release()
+
+        def launch(hedged):
+            model_name = pending.pop(0)
+            stats = self.get_stats(model_name)
+            stats.requests += 1
+            if hedged: stats.hedges += 1
+            handle = {'stream': None, 'cancelled': False}
+            thread = threading.Thread(target=attempt, args=(model_name, handle), name=f"ai-attempt-{model_name}", daemon=True)
+            thread.start()
+            attempts.append((model_name, thread, time.time(), handle))
+
+        def cancel_losers(winner):
+            # 진 시도의 스트림을 직접 취소 (아직 열리는 중이면 열리자마자 닫히도록 표시)
+            for model_name, _, _, handle in attempts:
+                if model_name == winner: continue
+                handle['cancelled'] = True
+                if handle['stream'] is not None: cancel_ai_stream(handle['stream'])
+
+        if not self.admit(deadline): raise TimeoutError("AI 호출 한도 대기 중 제한 시간 초과")
+        launch(hedged=False)
+        while True:
+            winner = state['winner']
+            if winner is not None:
+                cancel_losers(winner)
+                next(t for m, t, _, _ in attempts if m == winner).join(max(deadline - time.time(), 0) + 1)
+                self.get_stats(winner).wins += 1
+                if winner in state['errors']: raise state['errors'][winner]
+                return winner
+            running = [(m, t, at) for m, t, at, _ in attempts if t.is_alive()]
+            if not running:
+                if not pending or job.is_abandoned() or time.time() > deadline:
+                    raise next(reversed(state['errors'].values()), TimeoutError("AI 응답 제한 시간 초과"))
+                # 실패하면 다음 모델로 바로 넘어감 (헤지와 달리 자리/호출 한도 대기 허용)
+                if not self.admit(deadline): raise TimeoutError("AI 호출 한도 대기 중 제한 시간 초과")
+                launch(hedged=False)
+            elif pending and len(running) == 1:
+                model_name, _, launched_at = running[0]
+                # 헤지는 동시 호출 자리와 호출 한도에 여유가 있을 때만 (기다리지 않음)
+                if time.time() - launched_at > self.hedge_delay(model_name) and self.admit(time.time()):
+                    launch(hedged=True)
+            time.sleep(0.05)
+
+# ---------------------------------------------------------
+# [AI 작업자] 프로세스 공용 백그라운드 스레드 풀에서 Gemini 호출
+# 세션의 스크립트 스레드는 질문을 대기열에 넣고 바로 반환하며, 답변은 주기적으로 다시 실행되는
+# 조각(fragment)이 받아간 만큼씩 화면에 표시합니다.
+# - 대기열 크기 제한: 넘치면 즉시 '대기열 가득' 안내 (queue.Full)
+# - 동시 호출 수 제한: 작업 스레드 수 = AI_MAX_CONCURRENCY, 헤지/대체 요청까지 포함한 실제 모델 호출도 같은 한도
+# - 토큰 버킷: 분당 AI_RATE_PER_MIN회, 순간 최대 AI_RATE_BURST회까지 호출
+# - 같은 질문(응답 캐시 키 기준)이 처리 중이면 새로 호출하지 않고 진행 중인 작업에 합류
+# ---------------------------------------------------------
+AI_MAX_CONCURRENCY = 4
+AI_QUEUE_SIZE = 32
+AI_RATE_PER_MIN = 30
+AI_RATE_BURST = 5
+AI_POLL_INTERVAL_SEC = 0.5
+AI_ABANDON_SEC = 15  # 이 시간 동안 아무 세션도 결과를 확인하지 않으면 사용자가 떠난 것으로 보고 취소
+
+class TokenBucket:
+    def __init__(self, rate_per_sec, capacity):
+        self.rate = rate_per_sec
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if time.time() + wait > deadline: return False
+            time.sleep(wait)
+
+class AiJob:
+    def __init__(self, key, models, full_prompt, on_success=None):
+        self.key = key
+        self.models = models
+        self.full_prompt = full_prompt
+        self.on_success = on_success
+        self.chunks = []
+        self.model_name = None
+        self.error = None
+        self.done = False
+        self.started = time.time()
+        self.last_polled = time.time()
+
+    @property
+    def text(self):
+        return "".join(self.chunks)
+
+    def is_abandoned(self):
+        return time.time() - self.last_polled > AI_ABANDON_SEC
+
+class AiWorker:
+    def __init__(self, max_workers=AI_MAX_CONCURRENCY, queue_size=AI_QUEUE_SIZE, rate_per_min=AI_RATE_PER_MIN, burst=AI_RATE_BURST):
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.bucket = TokenBucket(rate_per_min / 60.0, burst)
+        self.router = ModelRouter(self.bucket, threading.BoundedSemaphore(max_workers))
+        self.active = 0
+        self.completed = 0
+        self.coalesced = 0
+        self.rejected = 0
+        for i in range(max_workers):
+            threading.Thread(target=self._run, name=f"ai-worker-{i}", daemon=True).start()
+
+    def submit(self, key, models, full_prompt, on_success=None):
+        with self._lock:
+            job = self._inflight.get(key)
+            if job is not None:
+                self.coalesced += 1
+                return job
+            job = AiJob(key, models, full_prompt, on_success)
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                self.rejected += 1
+                raise
+            self._inflight[key] = job
+            return job
+
+    @property
+    def waiting(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            with self._lock: self.active += 1
+            try:
+                self._process(job)
+            except Exception as e:
+                job.error = e
+            finally:
+                job.done = True
+                with self._lock:
+                    self.active -= 1
+                    self.completed += 1
+                    if self._inflight.get(job.key) is job: del self._inflight[job.key]
+
+    def _process(self, job):
+        job.model_name = self.router.run(job, job.started + AI_REQUEST_TIMEOUT_SEC)
+        if job.on_success: job.on_success(job.model_name, job.text, time.time() - job.started)
+
+@st.cache_resource
+def get_ai_worker():
+    return AiWorker()
+
+# ---------------------------------------------------------
+# [AI 대화 세션] 같은 주제의 후속 질문은 데이터 컨텍스트를 다시 만들지 않고 재사용
+# 주제 = 질문에서 추출한 영웅/길드/날짜. 개체가 없는 후속 질문("그럼 펫은?")이나 기존 주제에 포함된
+# 질문은 같은 데이터를 그대로 쓰고(검색/집계 생략), 기존 주제와 겹치면서 새 개체가 추가되면 아직 보내지 않은
+# 데이터 줄만 덧붙입니다. 덧붙이면 AI_CONTEXT_TOKEN_BUDGET을 넘는 경우에는 기존 + 새 개체로 다시 뽑은
+# 컨텍스트(예산 안)로 통째로 바꾸므로, 데이터 컨텍스트와 보낸 줄 목록은 예산 이상으로 커지지 않습니다.
+# 겹치지 않으면 새 주제로 시작합니다. 이전 턴은 최근 답변은 길게, 오래된 답변은 짧게 줄인 요약으로만 전달합니다.
+# ---------------------------------------------------------
+AI_SUMMARY_TOKEN_BUDGET = 600
+AI_DELTA_TOKEN_BUDGET = 600
+AI_RECENT_TURNS = 2
+AI_RECENT_ANSWER_CHARS = 300
+AI_OLD_ANSWER_CHARS = 80
+AI_CONVERSATION_MAX_TURNS = 10  # 요약에 쓰는 이전 턴 보관 개수
+
+class AiConversation:
+    def __init__(self, content_id, entities, data_context):
+        self.content_id = content_id
+        self.entities = {kind: set(names) for kind, names in entities.items()}
+        self.set_context(data_context)
+        self.turns = []
+        self.turn_count = 0
+
+    def add_entities(self, entities):
+        for kind, names in entities.items(): self.entities.setdefault(kind, set()).update(names)
+
+    def set_context(self, data_context):
+        self.context = data_context
+        self.sent_lines = set(data_context.splitlines())
+
+    def relation(self, content_id, entities):
+        # 'same': 기존 주제 안의 질문 / 'extend': 겹치면서 새 개체 추가 / 'new': 새 주제
+        if content_id != self.content_id: return 'new'
+        asked = {kind: set(names) for kind, names in entities.items()}
+        if not any(asked.values()): return 'same'
+        if all(asked[kind] <= self.entities.get(kind, set()) for kind in asked): return 'same'
+        if any(asked[kind] & self.entities.get(kind, set()) for kind in asked): return 'extend'
+        return 'new'
+
+    def extend(self, entities, data_context, token_budget=AI_DELTA_TOKEN_BUDGET, context_budget=AI_CONTEXT_TOKEN_BUDGET):
+        # 새 데이터 줄만 관련도 순으로 예산만큼 추가. 소속 섹션 제목/표 머리줄은 다시 붙여 줌
+        # 반환값: (추가한 줄, 컨텍스트를 다시 만들었는지)
+        delta, headers, used = [], [], 0
+        for line in data_context.splitlines():
+            if not line.strip(): continue
+            if line.startswith('| 상대 방어팀') or line.startswith('|---'):
+                headers.append(line)
+                continue
+            if not line.startswith(('-', ' ', '|')):
+                headers = [line]
+                continue
+            if line in self.sent_lines: continue
+            cost = estimate_tokens("\n".join(headers + [line]))
+            if used + cost > token_budget: break
+            delta += headers + [line]
+            headers = []
+            used += cost
+        self.add_entities(entities)
+        if not delta: return delta, False
+        extended = self.context + "\n[추가 데이터]\n" + "\n".join(delta) + "\n"
+        if estimate_tokens(extended) > context_budget:
+            # data_context는 기존 + 새 개체로 예산 안에서 뽑은 것이므로 그대로 교체
+            self.set_context(data_context)
+            return [], True
+        self.context = extended
+        self.sent_lines.update(delta)
+        return delta, False
+
+    def add_turn(self, question, answer):
+        self.turns.append((question, answer))
+        del self.turns[:-AI_CONVERSATION_MAX_TURNS]
+        self.turn_count += 1
+
+    def summary(self):
+        lines = []
+        for i, (question, answer) in enumerate(self.turns):
+            limit = AI_RECENT_ANSWER_CHARS if i >= len(self.turns) - AI_RECENT_TURNS else AI_OLD_ANSWER_CHARS
+            answer = " ".join(answer.split())
+            if len(answer) > limit: answer = answer[:limit] + "…"
+            lines.append(f"- Q: {question} / A: {answer}")
+        while lines and estimate_tokens("\n".join(lines)) > AI_SUMMARY_TOKEN_BUDGET: lines.pop(0)
+        return "\n".join(lines)
 
 # ---------------------------------------------------------
 # 3. 메인 UI 구성
@@ -505,16 +1976,26 @@ st.markdown(f"""
 """, unsafe_allow_html=True)
 
 if df is None:
-    st.error("데이터 파일을 찾을 수 없습니다. (길드전 답지.xlsx 또는 .csv)")
+    st.error("데이터 파일을 찾을 수 없습니다. (길드전 답지.xlsx 또는 .csv, 또는 war_data 폴더)")
     st.stop()
 
+CARDS_PER_PAGE = 10  # 공격 덱 추천 탭에서 한 번에 그리는 방어덱 카드 수
+
+def set_session_value(key, value):
+    st.session_state[key] = value
+
 # --- 탭 구성 ---
 tab1, tab2, tab3, tab4 = st.tabs(["⚔️ 공격 덱 추천", "📖 매치업 상세 가이드", "🤖 AI 전략가 (Beta)", "📢 안내 및 소식"])
 
 # =========================================================
 # TAB 1: 공격 추천
 # =========================================================
-with tab1:
+@st.fragment
+def render_attack_tab():
+    # 사이드바 필터와 카드는 이 프래그먼트 안에서만 다시 실행됨 (다른 탭은 그대로 유지)
+    snapshot = get_dataset_store().snapshot
+    df = snapshot.df
+    guide_store = get_guide_store()
     with st.sidebar:
         st.header("🔍 필터 옵션")
         view_type = st.radio("데이터 기준", ["전체", "공격 (우리가 공격)", "방어 (상대가 공격)"], horizontal=True)
@@ -526,14 +2007,19 @@ with tab1:
         unique_dates = sorted(df['날짜'].unique().tolist(), reverse=True)
         if 'selected_date_list' not in st.session_state:
             st.session_state['selected_date_list'] = unique_dates 
+        elif st.session_state.get('data_version') != snapshot.version:
+            # 데이터가 교체되면 필터 상태는 유지하되, '모두 선택' 상태였다면 새 날짜까지 포함
+            prev_dates = st.session_state.get('data_dates', [])
+            kept = [d for d in st.session_state['selected_date_list'] if d in unique_dates]
+            if set(st.session_state['selected_date_list']) >= set(prev_dates): kept = unique_dates
+            st.session_state['selected_date_list'] = kept
+        st.session_state['data_version'] = snapshot.version
+        st.session_state['data_dates'] = unique_dates
         
         col1, col2 = st.columns(2)
-        if col1.button("모두 선택"):
-            st.session_state['selected_date_list'] = unique_dates
-            st.rerun()
-        if col2.button("최근 5번"):
-            st.session_state['selected_date_list'] = unique_dates[:5] if len(unique_dates) >= 5 else unique_dates
-            st.rerun()
+        # 콜백에서 상태를 바꾸면 별도 st.rerun 없이 프래그먼트 재실행에 바로 반영됨
+        col1.button("모두 선택", on_click=set_session_value, args=('selected_date_list', unique_dates))
+        col2.button("최근 5번", on_click=set_session_value, args=('selected_date_list', unique_dates[:5] if len(unique_dates) >= 5 else unique_dates))
         selected_dates = st.multiselect("📅 날짜 선택", unique_dates, key='selected_date_list')
         st.divider()
 
@@ -541,181 +2027,216 @@ with tab1:
         selected_guilds = st.multiselect("🏰 상대 길드 선택", unique_guilds)
         st.divider()
 
-        all_atk_heroes = set()
+        hero_ids = df.attrs.get('hero_ids', {})
+        unique_heroes = []
         if not df.empty:
-            for team in df['공격팀_정렬'].dropna():
-                heroes = [h.strip() for h in team.split(',')]
-                all_atk_heroes.update(heroes)
-        unique_heroes = sorted(list(all_atk_heroes))
+            atk_union = np.bitwise_or.reduce(get_team_masks(df, '공격팀_정렬'), axis=0)
+            unique_heroes = sorted(mask_to_heroes(atk_union, hero_ids))
         excluded_heroes = st.multiselect("🚫 사용한 영웅 제외", unique_heroes, placeholder="이미 사용한 영웅을 선택하세요")
         if excluded_heroes: st.caption(f"선택한 영웅({len(excluded_heroes)}명)이 포함된 공격 덱은 제외됩니다.")
+        st.divider()
 
-    filtered_df = df.copy()
-    if "공격" in view_type and view_type != "전체": filtered_df = filtered_df[filtered_df['기준'] == '공격']
-    elif "방어" in view_type and view_type != "전체": filtered_df = filtered_df[filtered_df['기준'] == '방어']
-        
-    if search_query:
-        query_terms = [k.strip() for k in search_query.replace(',', ' ').split() if k.strip()]
-        if query_terms:
-            mask = filtered_df['방어팀_정렬'].apply(lambda x: check_match(x, query_terms))
-            filtered_df = filtered_df[mask]
-    if selected_dates: filtered_df = filtered_df[filtered_df['날짜'].isin(selected_dates)]
-    if selected_guilds: filtered_df = filtered_df[filtered_df['상대 길드'].isin(selected_guilds)]
-    
-    if excluded_heroes:
-        excluded_set = set(excluded_heroes)
-        mask = filtered_df['공격팀_정렬'].apply(lambda x: set([h.strip() for h in x.split(',')]).isdisjoint(excluded_set))
-        filtered_df = filtered_df[mask]
+        record_session_usage()
+        with st.expander("🧮 서버 메모리/캐시 현황"):
+            session_count, session_bytes = get_session_registry().summary()
+            shared_usage = get_shared_memory_usage(snapshot, guide_store)
+            shared_bytes = sum(size for _, size in shared_usage)
+            per_session = session_bytes / session_count if session_count else 0
+            st.caption(f"공유 데이터 (v{snapshot.version}, {len(df)}건): {shared_bytes / 1024 / 1024:.2f} MB · 1벌 (AI 검색 인덱스 제외)")
+            st.caption(" · ".join(f"{label} {size / 1024 / 1024:.2f} MB" for label, size in shared_usage))
+            st.caption(f"접속 세션 {session_count}개 · 세션당 평균 {per_session / 1024:.1f} KB · 합계 {session_bytes / 1024:.1f} KB")
+            response_cache = get_response_cache()
+            st.caption(f"AI 응답 캐시 {len(response_cache)}개 · 적중 {response_cache.hits}회 / 미스 {response_cache.misses}회 · 절약한 응답 대기 약 {response_cache.saved_sec:.0f}초")
+            html_cache = get_html_cache()
+            st.caption(f"HTML 조각 캐시 {len(html_cache)}개 · 적중 {html_cache.hits}회 / 생성 {html_cache.misses}회")
+            st.caption(f"공략 {len(guide_store)}개 (방덱 {len(guide_store.index)}개) · 본문 읽기 {guide_store.body_reads}회")
+            ai_worker = get_ai_worker()
+            st.caption(f"AI 작업자: 처리 중 {ai_worker.active}건 · 대기 {ai_worker.waiting}건 · 완료 {ai_worker.completed}건 · 같은 질문 합류 {ai_worker.coalesced}건 · 대기열 초과 {ai_worker.rejected}건")
+            for model_name, stats in list(ai_worker.router.stats.items()):
+                p50, p90 = stats.percentile(50), stats.percentile(AI_HEDGE_PERCENTILE)
+                latency_text = f"첫 응답 p50 {p50:.1f}초 / p{AI_HEDGE_PERCENTILE} {p90:.1f}초" if p50 is not None else "지연 기록 없음"
+                st.caption(f"└ {model_name}: 요청 {stats.requests}회 · 오류율 {stats.error_rate * 100:.0f}% · {latency_text} · 헤지 {stats.hedges}회 · 채택 {stats.wins}회")
+
+    view_filter = None
+    if "공격" in view_type and view_type != "전체": view_filter = '공격'
+    elif "방어" in view_type and view_type != "전체": view_filter = '방어'
+
+    query_terms = [k.strip() for k in search_query.replace(',', ' ').split() if k.strip()] if search_query else []
+
+    filtered_count, matchup_index = get_filtered_matchup_index(snapshot, view_filter, query_terms, selected_dates, selected_guilds, excluded_heroes)
+
+    # 필터가 바뀌면 카드 표시 개수를 첫 페이지로 되돌림
+    filter_key = make_filter_key(snapshot.version, view_filter, query_terms, selected_dates, selected_guilds, excluded_heroes)
+    if st.session_state.get('card_filter_key') != filter_key:
+        st.session_state['card_filter_key'] = filter_key
+        st.session_state['card_limit'] = CARDS_PER_PAGE
 
-    if filtered_df.empty: st.info("검색 결과가 없습니다.")
+    if filtered_count == 0: st.info("검색 결과가 없습니다.")
     else:
-        grouped = filtered_df.groupby('방어팀_정렬')
-        display_list = []
-        for defense, group in grouped: display_list.append({'defense': defense, 'count': len(group), 'data': group})
-        display_list.sort(key=lambda x: x['count'], reverse=True)
-
-        for item in display_list:
-            defense_team = item['defense']
-            match_count = item['count']
-            group_data = item['data']
-            atk_counts = group_data['공격팀_정렬'].value_counts()
-            if atk_counts.empty: continue
-            best_atk_team = atk_counts.idxmax()
-            best_atk_count = atk_counts.max()
-            pick_rate = (best_atk_count / match_count) * 100
-            best_atk_data = group_data[group_data['공격팀_정렬'] == best_atk_team]
-            best_pet, best_pet_count = get_mode(best_atk_data['공격팀 펫'])
-            best_skill, best_skill_count = get_mode(best_atk_data['공격팀 스순'])
-            speed_dist = get_speed_distribution(best_atk_data['속공'])
-            def_tags = format_hero_tags(defense_team)
-            atk_tags = format_hero_tags(best_atk_team)
-            badge_style, badge_text = get_badge_style(match_count, pick_rate)
-            bar_color = badge_style.split(":")[1].replace(";", "").strip()
-            
-            # [팝업 체크]
-            guide_available = False
-            matched_guide = None
-            matched_enemy_key = ""
-            if defense_team in MATCHUP_DB:
-                if best_atk_team in MATCHUP_DB[defense_team]:
-                    guide_available = True
-                    matched_guide = MATCHUP_DB[defense_team][best_atk_team]
-                    matched_enemy_key = defense_team
-            
-            raw_html = f"""
-                <div class="custom-card">
-                    <div class="card-header">
-                        <div style="flex: 1;"><span class="def-label">VS</span>{def_tags}</div>
-                        <div class="badge" style="{badge_style}">{badge_text} ({match_count}건)</div>
-                    </div>
-                    <div class="info-row">
-                        <div style="display:flex; justify-content:space-between; align-items:flex-end; margin-bottom:5px;">
-                            <div class="label">⚔️ 추천 공격팀</div>
-                            <div class="pick-rate-text">{pick_rate:.1f}% 픽률</div>
-                        </div>
-                        <div class="value">{atk_tags}</div>
-                        <div class="progress-container"><div class="progress-bg"><div class="progress-fill" style="width: {pick_rate}%; background-color: {bar_color};"></div></div></div>
-                    </div>
-                    <div class="grid-2">
-                        <div><div class="label">🐶 펫 <span style='font-weight:400; font-size:0.75em'>({best_pet_count}회)</span></div><div class="value">{best_pet}</div></div>
-                        <div><div class="label">🏃 속공</div><div class="value" style="font-size:0.95rem;">{speed_dist}</div></div>
-                    </div>
-                    <div class="info-row" style="margin-top: 15px;">
-                        <div class="label">⚡ 추천 스순 <span style='font-weight:400; font-size:0.8em'>({best_skill_count}회)</span></div>
-                        <div class="skill-box">{best_skill}</div>
-                    </div>
-                </div>
-            """
-            st.markdown(clean_html(raw_html), unsafe_allow_html=True)
+        card_limit = st.session_state['card_limit']
+        for defense_team, match_count in matchup_index.defenses[:card_limit]:
+            atk_list = matchup_index.attacks.get(defense_team, [])
+            if not atk_list: continue
+            best_atk_team = atk_list[0]
+            best = matchup_index.summaries[(defense_team, best_atk_team)]
+            st.markdown(get_card_html(defense_team, match_count, best_atk_team, best), unsafe_allow_html=True)
             
             st.markdown("<div style='margin-bottom:5px; font-size:0.85rem; color:#6b7280;'>🔻 공격팀별 상세 기록</div>", unsafe_allow_html=True)
             
-            atk_groups = [ (k, v) for k, v in group_data.groupby('공격팀_정렬') ]
-            atk_groups.sort(key=lambda x: len(x[1]), reverse=True)
-
-            for atk_team, atk_df in atk_groups:
-                cnt = len(atk_df); ratio = (cnt / match_count) * 100
+            for atk_team in atk_list:
+                summary = matchup_index.summaries[(defense_team, atk_team)]
+                cnt = summary['count']; ratio = (cnt / match_count) * 100
                 
                 guide_available_sub = False
-                matched_guide_sub = None
                 matched_enemy_key_sub = ""
-                if defense_team in MATCHUP_DB:
-                    if atk_team in MATCHUP_DB[defense_team]:
-                        guide_available_sub = True
-                        matched_guide_sub = MATCHUP_DB[defense_team][atk_team]
-                        matched_enemy_key_sub = defense_team
+                if guide_store.has(defense_team, atk_team):
+                    guide_available_sub = True
+                    matched_enemy_key_sub = defense_team
                         
                 expander_title = f"⚔️ {atk_team} ({cnt}회 / {ratio:.1f}%)"
                 if guide_available_sub: expander_title += "\u00A0" * 4 + ":violet-background[**📖 공략 있음**]"
 
-                with st.expander(expander_title):
+                # 펼쳐진 조합만 세부 내용을 그림 (접힌 상태에서는 표/세팅 요약을 만들지 않음)
+                atk_expander = st.expander(expander_title, key=f"exp_{defense_team}_{atk_team}", on_change="rerun")
+                if not atk_expander.open: continue
+                with atk_expander:
                     if guide_available_sub:
                         if st.button("📖 세팅 디테일 보기", key=f"btn_{defense_team}_{atk_team}"):
-                            show_guide_popup(matched_enemy_key_sub, atk_team, matched_guide_sub)
+                            show_guide_popup(matched_enemy_key_sub, atk_team)
                             
-                    sub_pet, sub_pet_cnt = get_mode(atk_df['공격팀 펫'])
-                    sub_skill, sub_skill_cnt = get_mode(atk_df['공격팀 스순'])
-                    sub_speed_dist = get_speed_distribution(atk_df['속공'])
-                    st.markdown(f"""
-                        <div style="background-color: #f9fafb; padding: 12px; border-radius: 8px; margin-bottom: 12px; border: 1px solid #e5e7eb;">
-                            <div style="font-size: 0.85rem; font-weight: 600; color: #4b5563; margin-bottom: 8px;">💡 이 조합의 추천 세팅</div>
-                            <div style="display: flex; flex-wrap: wrap; gap: 15px; font-size: 0.9rem;">
-                                <div>🐶 <b>{sub_pet}</b> <span style="color:#6b7280; font-size:0.8em">({sub_pet_cnt}회)</span></div>
-                                <div>🏃 {sub_speed_dist}</div>
-                                <div>⚡ <b>{sub_skill}</b> <span style="color:#6b7280; font-size:0.8em">({sub_skill_cnt}회)</span></div>
-                            </div>
-                        </div>
-                    """, unsafe_allow_html=True)
-                    detail_counts = atk_df.groupby(['공격팀 펫', '공격팀 스순', '속공', '방어팀 펫', '방어팀 스순']).size().reset_index(name='빈도')
-                    detail_counts = detail_counts.sort_values('빈도', ascending=False)
-                    detail_counts.columns = ['공격 펫', '공격 스순', '속공', '방어 펫', '방어 스순', '빈도']
+                    st.markdown(get_setting_html(summary), unsafe_allow_html=True)
+                    detail_counts = matchup_index.get_detail_table(defense_team, atk_team)
                     st.dataframe(detail_counts, use_container_width=True, hide_index=True, column_config={"빈도": st.column_config.NumberColumn(format="%d회")})
             st.markdown("<div style='margin-bottom: 30px;'></div>", unsafe_allow_html=True)
 
+        remaining = len(matchup_index.defenses) - card_limit
+        if remaining > 0:
+            st.caption(f"방어덱 {len(matchup_index.defenses)}개 중 {card_limit}개 표시 중")
+            st.button(f"⬇️ 방어덱 더 보기 ({min(CARDS_PER_PAGE, remaining)}개)", key="btn_more_cards",
+                      on_click=set_session_value, args=('card_limit', card_limit + CARDS_PER_PAGE))
+
+with tab1:
+    render_attack_tab()
+
 # =========================================================
 # TAB 2: 매치업 상세 가이드
 # =========================================================
-with tab2:
+@st.fragment
+def render_guide_tab():
     st.header("📖 매치업 상세 가이드")
     st.caption("특정 방덱을 상대로 어떤 공덱을 어떻게 써야 하는지 확인하세요.")
     search_query_guide = st.text_input("🛡️ 상대 방덱 검색", placeholder="예: 카구라, 오공 (비워두면 전체 보기)")
     
-    all_enemies = list(MATCHUP_DB.keys())
+    guide_store = get_guide_store()
+    if guide_store.skipped:
+        st.caption(f"⚠️ 공략 파일에서 읽지 못한 줄: {', '.join(map(str, guide_store.skipped))}")
+    all_enemies = guide_store.enemies()
     target_enemies = []
     
     if search_query_guide:
         query_terms = [k.strip() for k in search_query_guide.replace(',', ' ').split() if k.strip()]
-        if query_terms: target_enemies = [e for e in all_enemies if check_match(e, query_terms)]
+        if query_terms: target_enemies = [all_enemies[i] for i in get_guide_search_index(guide_store.signature, all_enemies).lookup(query_terms)]
     else: target_enemies = all_enemies
     
     if not target_enemies: st.info("검색 결과가 없습니다.")
     else:
         for enemy_name in target_enemies:
-            with st.expander(f"🛡️ VS {enemy_name}", expanded=False):
-                my_decks_map = MATCHUP_DB[enemy_name]
-                if len(my_decks_map) > 1:
-                    tabs = st.tabs([f"⚔️ {name}" for name in my_decks_map.keys()])
-                    for i, (my_deck_name, guide) in enumerate(my_decks_map.items()):
-                        with tabs[i]:
-                            html_content = generate_guide_html(enemy_name, my_deck_name, guide)
-                            st.markdown(clean_html(html_content), unsafe_allow_html=True)
-                else:
-                    my_deck_name = list(my_decks_map.keys())[0]
-                    guide = my_decks_map[my_deck_name]
-                    html_content = generate_guide_html(enemy_name, my_deck_name, guide)
-                    st.markdown(clean_html(html_content), unsafe_allow_html=True)
+            # 펼친 방덱/선택된 공덱 탭의 공략 본문만 읽어서 그림 (목록은 인덱스만으로 표시)
+            enemy_expander = st.expander(f"🛡️ VS {enemy_name}", key=f"guide_exp_{enemy_name}", on_change="rerun")
+            if enemy_expander.open:
+                with enemy_expander:
+                    my_deck_names = guide_store.decks(enemy_name)
+                    if len(my_deck_names) > 1:
+                        tabs = st.tabs([f"⚔️ {name}" for name in my_deck_names], key=f"guide_tabs_{enemy_name}", on_change="rerun")
+                        for deck_tab, my_deck_name in zip(tabs, my_deck_names):
+                            if not deck_tab.open: continue
+                            with deck_tab:
+                                st.markdown(get_guide_html(guide_store, enemy_name, my_deck_name), unsafe_allow_html=True)
+                    else:
+                        st.markdown(get_guide_html(guide_store, enemy_name, my_deck_names[0]), unsafe_allow_html=True)
             st.markdown("<div style='margin-bottom: 20px;'></div>", unsafe_allow_html=True)
 
+with tab2:
+    render_guide_tab()
+
 # =========================================================
 # TAB 3: AI 전략가 (Gemini)
 # =========================================================
-with tab3:
+# ---------------------------------------------------------
+# [대화 기록 제한] 세션당 메시지는 AI_CHAT_MAX_MESSAGES개까지만 보관
+# 넘치면 가장 오래된 질문/답변부터 한 줄 요약(chat_archive, 최대 AI_CHAT_ARCHIVE_LINES줄)으로 바꿔
+# 세션 메모리와 다시 그리는 비용이 대화 길이와 상관없이 일정하게 유지됩니다.
+# ---------------------------------------------------------
+AI_CHAT_WINDOW = 6
+AI_CHAT_MAX_MESSAGES = 30
+AI_CHAT_ARCHIVE_LINES = 30
+AI_CHAT_ARCHIVE_CHARS = 60
+
+def append_chat_message(role, content, caption=""):
+    messages = st.session_state.messages
+    messages.append({"role": role, "content": content, "caption": caption})
+    archive = st.session_state.chat_archive
+    while len(messages) > AI_CHAT_MAX_MESSAGES:
+        message = messages.pop(0)
+        text = " ".join(message["content"].split())
+        if len(text) > AI_CHAT_ARCHIVE_CHARS: text = text[:AI_CHAT_ARCHIVE_CHARS] + "…"
+        if message["role"] == "user" or not archive:
+            archive.append(f"Q: {text}" if message["role"] == "user" else f"A: {text}")
+        else:
+            archive[-1] += f" → A: {text}"
+    del archive[:-AI_CHAT_ARCHIVE_LINES]
+
+def render_chat_message(message):
+    with st.chat_message(message["role"]):
+        st.markdown(message["content"])
+        if message.get("caption"): st.caption(message["caption"])
+
+def add_assistant_message(content, caption=""):
+    append_chat_message("assistant", content, caption)
+    with st.chat_message("assistant"):
+        st.markdown(content)
+        if caption: st.caption(caption)
+    record_session_usage()
+
+# 백그라운드 작업 결과를 주기적으로 확인해 받은 만큼 표시 (스크립트 스레드를 붙잡지 않음)
+# 답변이 끝나면 대화 기록에 저장하고 탭 전체를 다시 그림
+@st.fragment(run_every=AI_POLL_INTERVAL_SEC)
+def render_pending_answer():
+    pending = st.session_state.get("ai_pending")
+    if not pending: return
+    job = pending["job"]
+    job.last_polled = time.time()
+    if not job.done:
+        with st.chat_message("assistant"):
+            if job.chunks:
+                st.markdown(job.text)
+            else:
+                worker = get_ai_worker()
+                st.caption(f"⏳ AI가 데이터를 분석 중입니다... (처리 중 {worker.active}건 · 대기 {worker.waiting}건)")
+        return
+
+    del st.session_state["ai_pending"]
+    if job.error is None:
+        response = job.text
+        conversation = st.session_state.get("ai_conversation")
+        if conversation is not None: conversation.add_turn(pending["question"], response)
+    elif job.chunks:
+        # 일부라도 받은 답변은 살리고 중단 사유만 덧붙임 (캐시에는 저장하지 않음)
+        response = job.text + f"\n\n⚠️ 답변이 중간에 끊겼습니다. ({job.error})"
+    else:
+        response = describe_ai_error(job.error)
+    append_chat_message("assistant", response, pending["caption"] if job.error is None else "")
+    record_session_usage()
+    st.rerun()
+
+@st.fragment
+def render_ai_tab():
     st.header("🤖 AI 전략가 (Beta)")
     st.caption("판다 길드전 데이터를 학습한 AI에게 질문해보세요!")
 
     if not HAS_GENAI:
         st.error("⚠️ `google-generativeai` 라이브러리가 설치되지 않았습니다. 관리자에게 문의하세요.")
-        st.stop()
+        return
     
     # st.secrets를 사용하여 안전하게 API 키 불러오기
     try:
@@ -727,70 +2248,110 @@ with tab3:
     
     if USER_API_KEY:
         os.environ["GOOGLE_API_KEY"] = USER_API_KEY
-        genai.configure(api_key=USER_API_KEY)
+        # GEMINI_API_ENDPOINT: 점검용 로컬 가짜 모델 서버 주소 (예: "http://127.0.0.1:8765")
+        api_endpoint = st.secrets.get("GEMINI_API_ENDPOINT")
+        if api_endpoint:
+            genai.configure(api_key=USER_API_KEY, transport="rest", client_options={"api_endpoint": api_endpoint})
+        else:
+            genai.configure(api_key=USER_API_KEY)
 
     if "messages" not in st.session_state:
         st.session_state.messages = []
+        st.session_state.chat_archive = []
+
+    if st.session_state.messages and st.button("🧹 새 대화 시작", disabled=bool(st.session_state.get("ai_pending"))):
+        st.session_state.messages = []
+        st.session_state.chat_archive = []
+        st.session_state.pop("ai_conversation", None)
+
+    # 최근 AI_CHAT_WINDOW개만 항상 그리고, 그 이전 기록은 펼칠 때만 그림
+    older = st.session_state.messages[:-AI_CHAT_WINDOW]
+    archive = st.session_state.chat_archive
+    if older or archive:
+        history_title = f"📜 이전 대화 {len(older)}개" + (f" (+ 오래된 질문 {len(archive)}개 요약)" if archive else "")
+        history_expander = st.expander(history_title, key="exp_chat_history", on_change="rerun")
+        if history_expander.open:
+            with history_expander:
+                if archive: st.caption("\n".join(archive))
+                for message in older: render_chat_message(message)
+    for message in st.session_state.messages[-AI_CHAT_WINDOW:]:
+        render_chat_message(message)
 
-    for message in st.session_state.messages:
-        with st.chat_message(message["role"]):
-            st.markdown(message["content"])
+    if st.session_state.get("ai_pending"):
+        render_pending_answer()
 
-    if prompt := st.chat_input("질문을 입력하세요.. (예: 프레이야 방덱의 스킬 순서는 어떻게 돼?)"):
-        st.session_state.messages.append({"role": "user", "content": prompt})
+    if prompt := st.chat_input("질문을 입력하세요.. (예: 프레이야 방덱의 스킬 순서는 어떻게 돼?)", disabled=bool(st.session_state.get("ai_pending"))):
+        append_chat_message("user", prompt)
         with st.chat_message("user"):
             st.markdown(prompt)
 
         if not USER_API_KEY:
-             response = "🔒 **API Key가 설정되지 않았습니다.** `.streamlit/secrets.toml` 파일을 확인해주세요."
-        else:
-            try:
-                # 데이터 분석 및 요약 생성 (업그레이드된 로직 호출)
-                data_context = get_ai_context(df, MATCHUP_DB, user_query=prompt)
-                
-                # 지원되는 모델 리스트
-                candidate_models = ['gemini-3.1-pro-preview']
-                
-                response_text = ""
-                error_msg = ""
-                
-                for model_name in candidate_models:
-                    try:
-                        model = genai.GenerativeModel(model_name)
-                        full_prompt = f"""
-                        너는 '세븐나이츠 리버스' 게임의 길드전 전략 전문가야.
-                        아래 제공된 [길드전 데이터]를 바탕으로 사용자의 질문에 완벽히 답변해줘.
-                        
-                        [답변 원칙]
-                        1. **분석된 데이터** (방어팀 세팅, 공격팀 세팅 등)를 최우선 근거로 제시해.
-                        2. 사용자가 '방어팀의 스킬 순서'나 '방어덱 세팅'을 물어봤다면 제공된 데이터의 [방어팀 세팅] 값을 기반으로 구체적으로 답변해줘. (이제 데이터에 방어팀 스순 정보가 포함되어 있어!)
-                        3. 사용자가 특정 매치업을 물어봤다면, 방어팀과 공격팀의 펫, 스순, 속공 등을 종합적으로 비교해서 알려줘.
-                        4. 답변은 친절하고 간결하게, 가독성 좋게 마크다운으로 정리해줘.
-
-                        [길드전 데이터]
-                        {data_context}
-
-                        사용자 질문: {prompt}
-                        """
-                        with st.spinner(f"AI({model_name})가 데이터를 분석 중입니다..."):
-                            ai_response = model.generate_content(full_prompt)
-                            response_text = ai_response.text
-                            break 
-                    except Exception as e:
-                        error_msg = str(e)
-                        continue 
-                
-                if response_text:
-                    response = response_text
+            add_assistant_message("🔒 **API Key가 설정되지 않았습니다.** `.streamlit/secrets.toml` 파일을 확인해주세요.")
+            return
+        try:
+            snapshot = get_dataset_store().snapshot
+            ai_index = get_ai_index(snapshot.version, snapshot.df)
+            guide_store = get_guide_store()
+            response_cache = get_response_cache()
+            
+            # 지원되는 모델 리스트 (라우터가 지연/오류율에 따라 순서를 정하고 느리면 다음 모델로 헤지)
+            candidate_models = ['gemini-3.1-pro-preview', 'gemini-2.5-pro']
+
+            # 대화 주제 판단: 같은 주제면 데이터 재사용, 겹치면 새 데이터 줄만 추가, 아니면 새 주제
+            entities = ai_index.entities.extract(prompt.replace('?', ' ').replace('!', ' ').replace(',', ' '))
+            conversation = st.session_state.get("ai_conversation")
+            relation = conversation.relation(snapshot.content_id, entities) if conversation else 'new'
+
+            # 새 주제의 첫 질문만 응답 캐시 사용 (후속 질문의 답은 앞선 대화에 따라 달라짐)
+            # 캐시 적중이면 데이터 컨텍스트를 만들지 않음 -> 후속 질문이 오면 그때 만듦
+            cache_keys = {m: make_response_key(snapshot.content_id, m, prompt, ai_index) for m in candidate_models}
+            if relation == 'new':
+                conversation = AiConversation(snapshot.content_id, entities, "")
+                st.session_state.ai_conversation = conversation
+                cached_response = response_cache.get([cache_keys[m] for m in candidate_models])
+                if cached_response is not None:
+                    conversation.add_turn(prompt, cached_response)
+                    add_assistant_message(cached_response, "⚡ 같은 질문에 대한 저장된 답변입니다.")
+                    return
+
+            # 캐시를 못 찾은 새 주제, 새 개체가 추가된 주제, 캐시된 답변으로 시작해 아직 데이터가 없는 주제만 컨텍스트를 만듦
+            reuse_text = "데이터 재사용"
+            if relation in ('new', 'extend') or not conversation.context:
+                topic_names = [] if relation == 'new' else [n for names in conversation.entities.values() for n in names]
+                data_context = get_ai_context(snapshot.df, guide_store, user_query=" ".join([prompt] + topic_names), ai_index=ai_index,
+                                              retrieval=get_retrieval_index(snapshot.version, guide_store.signature, snapshot.df, guide_store))
+                if relation == 'new' or not conversation.context:
+                    conversation.add_entities(entities)
+                    conversation.set_context(data_context)
+                    reuse_text = "새 주제" if relation == 'new' else "새 데이터"
                 else:
-                    response = f"🚫 모든 AI 모델 연결 실패. 최신 패키지(`pip install --upgrade google-generativeai`) 설치가 필요합니다. (에러 원인: {error_msg})"
+                    # 기존 주제 개체까지 포함해 다시 뽑은 뒤 아직 보내지 않은 줄만 덧붙임
+                    delta_lines, rebuilt = conversation.extend(entities, data_context)
+                    reuse_text = "예산 초과로 데이터 다시 구성" if rebuilt else f"데이터 재사용 + 추가 {estimate_tokens(chr(10).join(delta_lines)):,} 토큰"
 
-            except Exception as e:
-                response = f"🚫 오류가 발생했습니다: {str(e)}"
+            if relation == 'new':
+                job_key = cache_keys[candidate_models[0]]
+                on_success = lambda model_name, text, elapsed: response_cache.put(cache_keys[model_name], text, elapsed)
+            else:
+                job_key = (id(conversation), conversation.turn_count, prompt)
+                on_success = None
 
-        st.session_state.messages.append({"role": "assistant", "content": response})
-        with st.chat_message("assistant"):
-            st.markdown(response)
+            # 백그라운드 작업자에게 전달 (이 스크립트 실행은 바로 끝남)
+            full_prompt = build_ai_prompt(conversation.context, prompt, conversation.summary())
+            job = get_ai_worker().submit(job_key, candidate_models, full_prompt, on_success=on_success)
+            st.session_state.ai_pending = {
+                "job": job,
+                "question": prompt,
+                "caption": f"📏 프롬프트 크기: 약 {estimate_tokens(full_prompt):,} 토큰 ({reuse_text} · 데이터 컨텍스트 {estimate_tokens(conversation.context):,} / 예산 {AI_CONTEXT_TOKEN_BUDGET:,})",
+            }
+        except Exception as e:
+            add_assistant_message(describe_ai_error(e) if isinstance(e, queue.Full) else f"🚫 오류가 발생했습니다: {str(e)}")
+            return
+        # 입력창을 잠그고 답변 확인 조각을 띄우기 위해 전체를 다시 그림
+        st.rerun()
+
+with tab3:
+    render_ai_tab()
 
 # =========================================================
 # TAB 4: 안내 및 소식
@@ -0,0 +1,8 @@
+# 영웅 별칭(닉네임) 데이터베이스
+# 구조: { "대표 이름": ["별칭1", "별칭2", ...] }
+# 엑셀 데이터와 공략 파일(matchup_guides.jsonl)을 불러올 때 별칭은 모두 대표 이름으로 바뀌어 저장됩니다.
+# 새 영웅/닉네임이 생기면 여기에만 추가하세요.
+
+HERO_ALIAS_DB = {
+    "브브": ["쁘"],
+}
@@ -1,119 +0,0 @@
-# 매치업 상세 가이드 데이터베이스
-# 구조: { "상대 방덱 이름": { "내 공덱 이름": { 상세 내용... } } }
-
-MATCHUP_DB = {
-    "오공 겔리두스 스파이크": {
-        "플라튼 엘리스 리나": {
-            "summary": "버티고 마지막에 플라튼 빔으로 hp승",
-            "difficulty": 2, # [추가] 세팅 난이도 (1~5)
-            "formation": "<b>공격 진형</b><br>전열 : <b>플라튼</b><br>후열 : <b>엘리스, 리나</b>",
-            # [수정] 덱 세팅을 리스트 형태로 구조화하여 가독성 확보
-            "my_setting": [
-                {"name": "플라튼", "desc": "조율자 방방받받 효저 최대"},
-                {"name": "리나", "desc": "성기사 생생받받 효저 최대"},
-                {"name": "엘리스", "desc": "조율자 생생받받 효저 최대"},
-                {"name": "펫", "desc": "파이크 6성"},
-                {"name": "속공", "desc": "상관없음"},
-            ],
-            "enemy_info": "상대 오공 겔리두스 덱일때, 유 펫 아닐때 가면 승률이 많이 높습니다.",
-            "operate_tips": "스킬 순서 : 플라튼2엘리스2엘리스1"
-        }
-    },
-    "트루드 스파이크 아멜리아": {
-        "린 멜키르 밀리아": {
-            "summary": "혼란으로 아멜리아 스킬 빗나가게 만들기",
-            "difficulty": 4, # [추가] 세팅 난이도 (1~5)
-            "formation": "<b>공격 진형</b><br>전열 : <b>밀리아</b><br>후열 : <b>린, 멜키르</b>",
-            "my_setting": [
-                {"name": "린", "desc": "추적자 약치받받"},
-                {"name": "멜키르", "desc": "조율자 효적100 공공"},
-                {"name": "밀리아", "desc": "수문장 or 수호자 막100"},
-                {"name": "펫", "desc": "루 6성, 크리 6성"},
-                {"name": "속공", "desc": "선공 필수"},
-            ],
-            "enemy_info": "아멜리아 혼란넣고 수정이랑 역류로 말려죽입니다. 전반요구치 ↓",
-            "operate_tips": "스킬 순서 : 린2 멜키르2 멜키르1"
-        }
-    },
-    "카일 카구라 브브": {
-        "카일 카구라 브브": {
-            "summary": "미러전 승률 높은 세팅",
-            "difficulty": 2, # [추가] 세팅 난이도 (1~5)
-            "formation": "<b>밸런스 진형</b><br>전열 : <b>카구라</b><br>후열 : <b>카일, 브브</b><br><br><b>보호 진형, 기본 진형</b> <span style='color: #ef4444;'><b>(딜 충분시)</b></span><br>전열 : <b>카일, 브브</b><br>후열 : <b>카구라</b>",
-            "my_setting": [
-                {"name": "카일", "desc": "조율자 내실"},
-                {"name": "카구라", "desc": "상관없음"},
-                {"name": "브브", "desc": "조율자 내실 약공100, 속공3순위 필수"},
-                {"name": "펫", "desc": "이린 6성"},
-                {"name": "속공", "desc": "선공 추천"},
-            ],
-            "enemy_info": "우리 카일1스에 상대 카일 무효화 2개 빠지고, 우리 카일 평타턴에 패시브 사슬 터지면서 상대 카일 무효화 0~1번 남고 브브2스로 권능씹고 원콤내서 불사 터트리고 우리 카일2로 마무리, 상대 밸진 카일, 브브 여도 브브 약공 100이면 면역 피해서 카일 찍습니다.",
-            "operate_tips": "스킬 순서 : 카일1 브브2 카일2"
-        }
-    },
-   "오공 겔리두스 엘리시아": {
-        "노호 리나 엘리스": {
-            "summary": "버티고 마지막에 생전, 힐로 hp승",
-            "difficulty": 3, # [추가] 세팅 난이도 (1~5)
-            "formation": "<b>밸런스 진형</b><br>전열 : <b>노호, 리나, 엘리스 (루디 카론 플라튼)</b><br>후열 : ",
-            "my_setting": [
-                {"name": "노호(플라튼)", "desc": "조율자 방방받받 효저 최대"},
-                {"name": "리나(카론)", "desc": "성기사 생생받받 효저 최대"},
-                {"name": "엘리스(루디)", "desc": "조율자 생생받받 효저 최대"},
-                {"name": "펫", "desc": "파이크 6성"},
-                {"name": "속공", "desc": "상관없음"},
-            ],
-            "enemy_info": "상대 에이스, 프레이야 없는 오공 덱일때 승률이 많이 높습니다. 템 되는대로 성기사, 수호자, 조율자중에 효저100 가까이 맞춰야 승률이 높습니다, 전반 필요없어서 연습모드 후 안죽는다 싶으면 cc나 방어력 막기 반지 추천합니다.",
-            "operate_tips": "스킬 순서 : 엘리스1노호1 고정 or 루디2플라튼2카론1 고정"
-        }
-    },
-    "여포공덱": {
-        "라드그리드 만능형2명": {
-            "summary": "라드그리드로 버티면서 여포공덱 쉽게 이깁니다.",
-            "difficulty": 1, # [추가] 세팅 난이도 (1~5)
-            "formation": "<b>공격 진형</b><br>전열 : <b>라드그리드</b><br>후열 : <b>엘리시아, 겔리두스, 트루드, 스파이크, 오공 등</b>",
-            "my_setting": [
-                {"name": "라드그리드", "desc": "성기사(수호자) 방방받받 막기 최대"},
-                {"name": "만능형1", "desc": "최대한 탱탱하게, 엘리시아면 조율자"},
-                {"name": "만능형2", "desc": "최대한 탱탱하게, 엘리시아면 조율자"},
-                {"name": "펫", "desc": "루, 카람, 파이크 6성"},
-                {"name": "속공", "desc": "상관없음"},
-            ],
-            "enemy_info": "라드그리드에 후열에 만능형 2명 집어넣고 여포덱 공격가면 웬만해선 이깁니다. 반지도 대랄까지 필요없고 중랄정도로 주시면 됩니다.",
-            "operate_tips": "스킬 순서 : 자유"
-        }
-    }
-}
-#        "즉사 덱": {
-#            "summary": "상대 힐러(에반 등)를 말려 죽이는 운영",
-#            "formation": "<b>방어 진형</b><br>전열 : <b>녹스, 챈슬러, 루크</b><br>후열 : <b>크리스</b>",
-#            "my_setting": [
-#                {"name": "크리스", "desc": "속속 / 생생 (상태이상 적중)"},
-#                {"name": "녹스", "desc": "속속 / 생생"},
-#                {"name": "챈슬러", "desc": "속속 / 생생"},
-#                {"name": "루크", "desc": "생생 / 막막"},
-#                {"name": "펫", "desc": "크리"},
-#            ],
-#            "enemy_info": "상대 린의 타격 횟수 무효화를 빠르게 벗기는 게 관건입니다.",
-#            "operate_tips": "크리스 2스킬을 아껴두었다가 상대 불사가 켜지면 즉사로 지워버리세요."
-#        }
-#    },
-#    "오공 방덱": {
-#        "제이브 방덱": {
-#            "summary": "반사 딜로 오공 분신을 지우는 카운터",
-#            "formation": "<b>기본 진형</b><br>전열 : <b>룩, 챈슬러</b><br>후열 : <b>제이브</b>",
-#            "my_setting": [
-#                {"name": "제이브", "desc": "생생 / 반반 (갑옷 3옵)"},
-#                {"name": "룩", "desc": "속속 / 막막"},
-#                {"name": "챈슬러", "desc": "속속 / 생생"},
-#                {"name": "펫", "desc": "루"},
-#            ],
-#            "enemy_info": "오공이 분신을 쓰자마자 제이브 광역기로 지워야 합니다.",
-#            "operate_tips": """
-#            1. 오공이 나오면 제이브가 맞으면서 반사 딜 누적.
-#            2. 룩의 보호막으로 오공의 폭딜을 한 턴 버팀.
-#            3. 제이브 각성기로 정리.
-#            """
-#        }
-#    }
-#}
@@ -0,0 +1,20 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+@pytest.fixture(scope="session")
+def app():
+    # app.py는 스트림릿 스크립트라 import 시 화면 코드까지 bare 모드로 한 번 실행됨 (데이터 파일은 저장소 기준 경로)
+    pytest.importorskip("streamlit")
+    pytest.importorskip("google.generativeai")
+    cwd = os.getcwd()
+    os.chdir(REPO_ROOT)
+    try:
+        yield importlib.import_module("app")
+    finally:
+        os.chdir(cwd)
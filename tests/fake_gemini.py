@@ -0,0 +1,100 @@
+# ---------------------------------------------------------
+# [점검용] Gemini REST API 가짜 서버
+# streamGenerateContent 요청에 모델별로 정해 둔 동작(오류 상태 코드, 첫 조각 전 지연, 답변 조각)으로 응답합니다.
+# app.py에서는 secrets의 GEMINI_API_ENDPOINT에 이 서버 주소를 넣으면 실제 API 대신 여기로 요청합니다.
+#   python tests/fake_gemini.py 8765  ->  GEMINI_API_ENDPOINT = "http://127.0.0.1:8765"
+# ---------------------------------------------------------
+import json
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MODEL_PATH_PATTERN = re.compile(r"/v1beta/models/([^/:]+):streamGenerateContent")
+DEFAULT_BEHAVIOR = {'status': 200, 'delay': 0.0, 'chunks': ["가짜 ", "답변입니다."], 'chunk_interval': 0.05}
+
+def make_chunk(text):
+    return {'candidates': [{'content': {'parts': [{'text': text}], 'role': 'model'}, 'index': 0}]}
+
+class FakeGeminiServer:
+    def __init__(self, behaviors=None, host='127.0.0.1', port=0):
+        # behaviors: {모델 이름: {'status': HTTP 상태, 'delay': 첫 조각 전 대기(초), 'chunks': [텍스트, ...]}}
+        self.behaviors = behaviors if behaviors is not None else {}
+        self.requests = []  # 요청 받은 모델 이름 (순서대로)
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self._httpd.serve_forever, name="fake-gemini", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                match = MODEL_PATH_PATTERN.match(self.path)
+                if not match:
+                    self.send_error(404)
+                    return
+                model_name = match.group(1)
+                behavior = {**DEFAULT_BEHAVIOR, **server.behaviors.get(model_name, {})}
+                with server._lock:
+                    server.requests.append(model_name)
+                    server.active += 1
+                    server.max_active = max(server.max_active, server.active)
+                try:
+                    self._respond(behavior)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # 클라이언트가 스트림을 취소함
+                finally:
+                    with server._lock: server.active -= 1
+
+            def _respond(self, behavior):
+                time.sleep(behavior['delay'])
+                if behavior['status'] != 200:
+                    body = json.dumps({'error': {'code': behavior['status'], 'message': "fake error", 'status': "UNAVAILABLE"}}).encode('utf-8')
+                    self.send_response(behavior['status'])
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                # 응답 조각을 JSON 배열로 조금씩 흘려보냄 (REST 스트리밍 형식, 연결 종료로 끝을 알림)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                for i, text in enumerate(behavior['chunks']):
+                    if i: time.sleep(behavior['chunk_interval'])
+                    prefix = "[" if i == 0 else ","
+                    self.wfile.write((prefix + json.dumps(make_chunk(text), ensure_ascii=False)).encode('utf-8'))
+                    self.wfile.flush()
+                self.wfile.write(b"]" if behavior['chunks'] else b"[]")
+                self.wfile.flush()
+
+        return Handler
+
+if __name__ == "__main__":
+    fake = FakeGeminiServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8765).start()
+    print(f"가짜 Gemini 서버 실행 중: {fake.url}")
+    try:
+        while True: time.sleep(1)
+    except KeyboardInterrupt:
+        fake.stop()
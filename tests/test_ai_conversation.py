@@ -0,0 +1,24 @@
+def make_conversation(app):
+    return app.AiConversation("content", {'hero': {"카구라"}, 'guild': set(), 'date': set()}, "📊 [메타]\n- 총 기록 건수: 10건\n")
+
+def test_extend_appends_only_unsent_lines(app):
+    conversation = make_conversation(app)
+    data_context = "📊 [메타]\n- 총 기록 건수: 10건\n📖 [공략]\n- VS 방어덱 [오공] -> 추천 공덱 [카구라]\n"
+
+    delta, rebuilt = conversation.extend({'hero': {"오공"}}, data_context)
+
+    assert not rebuilt
+    assert delta == ["📖 [공략]", "- VS 방어덱 [오공] -> 추천 공덱 [카구라]"]
+    assert conversation.context.endswith("[추가 데이터]\n📖 [공략]\n- VS 방어덱 [오공] -> 추천 공덱 [카구라]\n")
+    assert conversation.entities['hero'] == {"카구라", "오공"}
+
+def test_extend_past_context_budget_replaces_context(app):
+    conversation = make_conversation(app)
+    data_context = "📖 [공략]\n" + "".join(f"- 새 데이터 줄 {i}\n" for i in range(20))
+    budget = app.estimate_tokens(conversation.context) + 20
+
+    delta, rebuilt = conversation.extend({'hero': {"오공"}}, data_context, context_budget=budget)
+
+    assert rebuilt and delta == []
+    assert conversation.context == data_context
+    assert conversation.sent_lines == set(data_context.splitlines())
@@ -0,0 +1,5 @@
+def test_filter_key_canonicalizes_hero_aliases(app):
+    alias, canonical = next(iter(app.HERO_ALIASES.items()))
+
+    assert app.make_filter_key(1, None, [alias], [], [], []) == app.make_filter_key(1, None, [canonical], [], [], [])
+    assert app.make_filter_key(1, None, [alias, canonical], [], [], []) == app.make_filter_key(1, None, [canonical], [], [], [])
@@ -0,0 +1,20 @@
+import json
+
+def test_missing_guide_file_gives_empty_store_and_retrieval_index(app, tmp_path):
+    guide_store = app.GuideStore(str(tmp_path / "missing.jsonl"))
+
+    assert len(guide_store) == 0
+    assert list(guide_store.iter_guides()) == []
+    retrieval = app.AiRetrievalIndex(app.df, guide_store)
+    assert retrieval.search_guides("카구라") == []
+    assert "(관련 상세 가이드 없음)" not in app.get_ai_context(app.df, guide_store, "카구라 방덱 어때", retrieval=retrieval)
+
+def test_iter_guides_reads_bodies_in_index_order(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'CACHE_DIR', str(tmp_path / "cache"))
+    source = tmp_path / "guides.jsonl"
+    guides = [{'enemy': "오공", 'deck': "카구라", 'summary': "첫 공략"}, {'enemy': "오공", 'deck': "리나", 'summary': "둘째 공략"}]
+    source.write_text("\n".join(json.dumps(g, ensure_ascii=False) for g in guides) + "\n", encoding='utf-8')
+
+    guide_store = app.GuideStore(str(source))
+
+    assert [(key, info['summary']) for key, info in guide_store.iter_guides()] == [(("오공", "카구라"), "첫 공략"), (("오공", "리나"), "둘째 공략")]
@@ -0,0 +1,50 @@
+import threading
+import time
+
+import pytest
+
+from fake_gemini import FakeGeminiServer
+
+@pytest.fixture
+def fake_gemini(app):
+    server = FakeGeminiServer().start()
+    app.genai.configure(api_key="test-key", transport="rest", client_options={"api_endpoint": server.url})
+    yield server
+    server.stop()
+
+def test_falls_back_to_next_model_on_5xx(app, fake_gemini):
+    fake_gemini.behaviors.update({'broken': {'status': 503}, 'healthy': {'chunks': ["안녕", "하세요"]}})
+    router = app.ModelRouter()
+    job = app.AiJob("key", ['broken', 'healthy'], "질문")
+
+    assert router.run(job, time.time() + 10) == 'healthy'
+    assert job.text == "안녕하세요"
+    assert fake_gemini.requests == ['broken', 'healthy']
+    assert router.stats['broken'].error_rate == 1.0
+    assert router.stats['healthy'].hedges == 0
+
+def test_hedges_to_next_model_after_delay(app, fake_gemini, monkeypatch):
+    monkeypatch.setattr(app, 'AI_HEDGE_DEFAULT_DELAY_SEC', 0.3)
+    fake_gemini.behaviors.update({'slow': {'delay': 3.0, 'chunks': ["느린 답변"]}, 'fast': {'chunks': ["빠른 답변"]}})
+    router = app.ModelRouter()
+    job = app.AiJob("key", ['slow', 'fast'], "질문")
+
+    started = time.time()
+    assert router.run(job, time.time() + 10) == 'fast'
+    assert time.time() - started < 3.0
+    assert job.text == "빠른 답변"
+    assert router.stats['fast'].hedges == 1
+    assert router.stats['fast'].wins == 1
+    assert router.stats['slow'].wins == 0
+
+def test_hedge_is_skipped_without_a_free_concurrency_slot(app, fake_gemini, monkeypatch):
+    monkeypatch.setattr(app, 'AI_HEDGE_DEFAULT_DELAY_SEC', 0.2)
+    fake_gemini.behaviors.update({'slow': {'delay': 1.0, 'chunks': ["느린 답변"]}, 'fast': {}})
+    slots = threading.BoundedSemaphore(1)
+    router = app.ModelRouter(slots=slots)
+    job = app.AiJob("key", ['slow', 'fast'], "질문")
+
+    assert router.run(job, time.time() + 10) == 'slow'
+    assert fake_gemini.requests == ['slow']
+    assert fake_gemini.max_active == 1
+    assert slots.acquire(timeout=1)
@@ -0,0 +1,27 @@
+from types import SimpleNamespace
+
+import pytest
+
+@pytest.fixture
+def ai_index(app):
+    return SimpleNamespace(entities=app.build_entity_matcher(["오공", "프레이야", "브브"], ["판다 길드"], ["260101"]))
+
+def make_key(app, ai_index, question):
+    return app.make_response_key("content", "model", question, ai_index)
+
+def test_reversed_matchups_get_different_keys(app, ai_index):
+    assert make_key(app, ai_index, "오공 방덱을 프레이야로 잡는 법") != make_key(app, ai_index, "프레이야 방덱을 오공으로 잡는 법")
+    assert make_key(app, ai_index, "오공 방어덱 프레이야 공격덱") != make_key(app, ai_index, "오공 공격덱 프레이야 방어덱")
+
+def test_aliases_and_filler_words_share_a_key(app, ai_index):
+    assert make_key(app, ai_index, "쁘 방덱 스순 알려줘") == make_key(app, ai_index, "브브 방덱 스순")
+    assert make_key(app, ai_index, "쁘로 오공 잡는 법?") == make_key(app, ai_index, "브브로 오공 잡는 법")
+
+def test_lookup_over_candidate_models_counts_once(app, tmp_path):
+    cache = app.ResponseCache(str(tmp_path / "responses.json"), 10, 60)
+    cache.put("second-model-key", "저장된 답변", 3.0)
+
+    assert cache.get(["first-model-key", "second-model-key"]) == "저장된 답변"
+    assert (cache.hits, cache.misses) == (1, 0)
+    assert cache.get(["first-model-key", "other-key"]) is None
+    assert (cache.hits, cache.misses) == (1, 1)
@@ -0,0 +1,44 @@
+import json
+import os
+
+import pytest
+
+GOOD_ROWS = "방어팀,공격팀,상대 길드,기준\n오공,카구라,판다,공격\n오공,리나,판다,공격\n"
+BAD_ROWS = "이름,점수\n오공,10\n"
+
+@pytest.fixture
+def war_dir(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'STORE_DIR', str(tmp_path / "store"))
+    data_dir = tmp_path / "war_data"
+    data_dir.mkdir()
+    return data_dir
+
+def write_war_file(path, text):
+    path.write_text(text, encoding='cp949')
+
+def load_manifest(app):
+    with open(os.path.join(app.STORE_DIR, 'manifest.json'), encoding='utf-8') as f: return json.load(f)
+
+def test_file_missing_columns_is_skipped(app, war_dir):
+    write_war_file(war_dir / "260101.csv", GOOD_ROWS)
+    write_war_file(war_dir / "260102.csv", BAD_ROWS)
+
+    df = app.ingest_war_directory(str(war_dir))
+
+    assert len(df) == 2
+    assert set(df['날짜']) == {"260101"}
+    if app.HAS_PYARROW: assert list(load_manifest(app)['files']) == ["260101.csv"]
+
+def test_file_rewritten_without_columns_keeps_last_good_part(app, war_dir):
+    pytest.importorskip("pyarrow")
+    war_file = war_dir / "260101.csv"
+    write_war_file(war_file, GOOD_ROWS)
+    assert len(app.ingest_war_directory(str(war_dir))) == 2
+    entry = load_manifest(app)['files']["260101.csv"]
+
+    write_war_file(war_file, BAD_ROWS)
+    df = app.ingest_war_directory(str(war_dir))
+
+    assert len(df) == 2
+    assert set(df['공격팀_정렬']) == {"카구라", "리나"}
+    assert load_manifest(app)['files']["260101.csv"] == entry